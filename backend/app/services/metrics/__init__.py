@@ -0,0 +1,17 @@
+"""Metrics service."""
+
+from app.services.metrics.registry import (
+    DURATION_BUCKETS,
+    LATENCY_BUCKETS,
+    MetricsRegistry,
+    hashed_label,
+    metrics,
+)
+
+__all__ = [
+    "DURATION_BUCKETS",
+    "LATENCY_BUCKETS",
+    "MetricsRegistry",
+    "hashed_label",
+    "metrics",
+]
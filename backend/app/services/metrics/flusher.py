@@ -0,0 +1,36 @@
+import asyncio
+import contextlib
+
+from redis.asyncio import Redis
+
+from app.services.metrics.registry import metrics
+from app.settings import settings
+
+
+async def _flush_periodically(redis: Redis) -> None:
+    while True:
+        await asyncio.sleep(settings.metrics_flush_seconds)
+        await metrics.flush(redis)
+
+
+def start_metrics_flusher(redis: Redis) -> asyncio.Task:
+    """
+    Start pushing this process's metrics to Redis in the background.
+
+    :param redis: redis client, must stay open until the flusher stops.
+    :return: flusher task.
+    """
+    return asyncio.create_task(_flush_periodically(redis))
+
+
+async def stop_metrics_flusher(task: asyncio.Task, redis: Redis) -> None:
+    """
+    Stop the flusher and push what is left.
+
+    :param task: task from ``start_metrics_flusher``.
+    :param redis: redis client.
+    """
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    await metrics.flush(redis)
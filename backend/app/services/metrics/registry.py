@@ -0,0 +1,173 @@
+import hashlib
+import re
+from collections import defaultdict
+
+from loguru import logger
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+METRICS_PREFIX = "metrics"
+# Hash of sample line (name + labels) -> value, summed over all processes
+SAMPLES_KEY = f"{METRICS_PREFIX}:samples"
+# Hash of metric name -> prometheus type
+TYPES_KEY = f"{METRICS_PREFIX}:types"
+
+# For request latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# For extractions, downloads and ffmpeg runs
+DURATION_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+_LE_RE = re.compile(r',?le="([^"]+)"')
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in sorted(labels.items())
+    )
+    return f"{{{pairs}}}"
+
+
+def hashed_label(value: str) -> str:
+    """
+    Stable stand-in for a label value that must not be exposed.
+
+    :param value: sensitive value, e.g. an account name.
+    :return: short hex digest of it.
+    """
+    return hashlib.sha256(value.encode()).hexdigest()[:12]
+
+
+def _sort_key(line: str) -> tuple[str, float]:
+    # Keeps histogram buckets of a series together and in ascending order
+    sample = line.rsplit(" ", 1)[0]
+    match = _LE_RE.search(sample)
+    return _LE_RE.sub("", sample), float(match.group(1)) if match else 0.0
+
+
+class MetricsRegistry:
+    """
+    Process-local counters and histograms, merged into Redis.
+
+    Every API worker and taskiq worker records into its own registry, and
+    ``flush`` adds the accumulated deltas to a shared Redis hash with
+    HINCRBYFLOAT. The API then renders that hash, so ``/api/metrics``
+    shows totals over all processes. Download processes have no flusher,
+    what they measure is passed back to their worker and recorded there
+    (see ``DownloadResult``).
+
+    Histogram buckets are stored already cumulative, in the same
+    ``name_bucket{le="..."}`` form Prometheus expects.
+    """
+
+    def __init__(self) -> None:
+        self._samples: defaultdict[str, float] = defaultdict(float)
+        self._types: dict[str, str] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        """
+        Increment a counter.
+
+        :param name: metric name.
+        :param value: amount to add.
+        :param labels: metric labels.
+        """
+        self._types[name] = "counter"
+        self._samples[f"{name}{_format_labels(labels)}"] += value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels: str,
+    ) -> None:
+        """
+        Record a value in a histogram.
+
+        :param name: metric name.
+        :param value: observed value.
+        :param buckets: upper bounds of the buckets, the same for every call.
+        :param labels: metric labels.
+        """
+        self._types[name] = "histogram"
+        for bound in buckets:
+            # Empty buckets are written too, so every series has all of them
+            bucket = f"{name}_bucket{_format_labels({**labels, 'le': str(bound)})}"
+            self._samples[bucket] += 1 if value <= bound else 0
+        self._samples[f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})}"] += 1
+        self._samples[f"{name}_sum{_format_labels(labels)}"] += value
+        self._samples[f"{name}_count{_format_labels(labels)}"] += 1
+
+    async def flush(self, redis: Redis) -> None:
+        """
+        Add everything recorded since the last flush to Redis.
+
+        :param redis: redis client.
+        """
+        if not self._samples:
+            return
+        samples, self._samples = self._samples, defaultdict(float)
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(TYPES_KEY, mapping=self._types)
+                for sample, value in samples.items():
+                    pipe.hincrbyfloat(SAMPLES_KEY, sample, value)
+                await pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Failed to flush metrics: {exc}")
+            # Keep the deltas for the next attempt
+            for sample, value in samples.items():
+                self._samples[sample] += value
+
+
+def render_metrics(samples: dict[bytes, bytes], types: dict[bytes, bytes]) -> str:
+    """
+    Render samples stored by ``MetricsRegistry.flush`` in Prometheus text format.
+
+    :param samples: contents of the samples hash.
+    :param types: contents of the types hash.
+    :return: exposition text.
+    """
+    families: defaultdict[str, list[str]] = defaultdict(list)
+    type_names = {name.decode(): kind.decode() for name, kind in types.items()}
+    for raw_sample, raw_value in samples.items():
+        sample = raw_sample.decode()
+        name = sample.split("{", 1)[0]
+        family = name
+        for suffix in ("_bucket", "_sum", "_count"):
+            base = name.removesuffix(suffix)
+            if base != name and type_names.get(base) == "histogram":
+                family = base
+                break
+        families[family].append(f"{sample} {float(raw_value):g}")
+
+    lines: list[str] = []
+    for family in sorted(families):
+        lines.append(f"# TYPE {family} {type_names.get(family, 'untyped')}")
+        lines.extend(sorted(families[family], key=_sort_key))
+    return "\n".join(lines) + "\n"
+
+
+def render_gauge(name: str, values: list[tuple[dict[str, str], float]]) -> str:
+    """
+    Render a gauge computed at scrape time in Prometheus text format.
+
+    :param name: metric name.
+    :param values: (labels, value) pairs.
+    :return: exposition text.
+    """
+    lines = [f"# TYPE {name} gauge"]
+    lines.extend(
+        f"{name}{_format_labels(labels)} {value:g}" for labels, value in values
+    )
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
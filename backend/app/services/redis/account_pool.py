@@ -0,0 +1,274 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from uuid import uuid4
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from app.settings import settings
+
+ACCOUNT_PREFIX = "accounts"
+# Set of tripped accounts that must pass a probe before they are used again
+ACCOUNT_PROBATION_KEY = f"{ACCOUNT_PREFIX}:probation"
+
+# Latency assumed for accounts without successful requests yet, seconds
+_DEFAULT_LATENCY = 1.0
+# How often a download waiting for an account checks again
+_WAIT_POLL_SECONDS = 5.0
+# Outcomes kept per account. Counts are halved beyond this, so the success
+# rate follows recent behaviour
+_STATS_WINDOW = 100
+
+# Picks the account with the lowest (in-flight + 1) * latency / success
+# rate, skipping tripped ones, and leases it. KEYS[1] is the probation set,
+# then stats, circuit and lease keys for every account in ARGV[5:].
+# Returns the account, or nil if none is available.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local best, best_leases, best_score
+for i = 5, #ARGV do
+    local account = ARGV[i]
+    local base = (i - 5) * 3 + 1
+    local stats, circuit, leases = KEYS[base + 1], KEYS[base + 2], KEYS[base + 3]
+    if redis.call("EXISTS", circuit) == 0
+        and redis.call("SISMEMBER", KEYS[1], account) == 0 then
+        redis.call("ZREMRANGEBYSCORE", leases, "-inf", now)
+        local inflight = redis.call("ZCARD", leases)
+        local s = redis.call("HMGET", stats, "success", "failure", "latency")
+        local ok = tonumber(s[1]) or 0
+        local failed = tonumber(s[2]) or 0
+        local latency = tonumber(s[3]) or tonumber(ARGV[4])
+        local rate = (ok + 1) / (ok + failed + 2)
+        local score = (inflight + 1) * latency / rate
+        if best_score == nil or score < best_score then
+            best, best_leases, best_score = account, leases, score
+        end
+    end
+end
+if best == nil then
+    return nil
+end
+redis.call("ZADD", best_leases, ARGV[2], ARGV[3])
+return best
+"""
+
+# Ends a lease and records its outcome: "ok" (with an optional latency
+# sample), "failed" (the account's fault) or "other". Trips the circuit after ARGV[4]
+# failures in a row. KEYS: stats, circuit, leases, probation set.
+# Returns 1 if the circuit was tripped.
+RELEASE_SCRIPT = """
+redis.call("ZREM", KEYS[3], ARGV[1])
+local outcome = ARGV[2]
+local tripped = 0
+if outcome == "ok" then
+    local sample = tonumber(ARGV[3])
+    if sample then
+        local latency = tonumber(redis.call("HGET", KEYS[1], "latency"))
+        if latency then
+            sample = latency * 0.8 + sample * 0.2
+        end
+        redis.call("HSET", KEYS[1], "latency", tostring(sample))
+    end
+    redis.call("HINCRBY", KEYS[1], "success", 1)
+    redis.call("HSET", KEYS[1], "strikes", 0)
+elseif outcome == "failed" then
+    redis.call("HINCRBY", KEYS[1], "failure", 1)
+    local strikes = redis.call("HINCRBY", KEYS[1], "strikes", 1)
+    if strikes >= tonumber(ARGV[4]) then
+        redis.call("SET", KEYS[2], "open", "EX", ARGV[5])
+        redis.call("HSET", KEYS[1], "strikes", 0, "circuit_seconds", ARGV[5])
+        redis.call("SADD", KEYS[4], ARGV[6])
+        tripped = 1
+    end
+end
+local s = redis.call("HMGET", KEYS[1], "success", "failure")
+local ok = tonumber(s[1]) or 0
+local failed = tonumber(s[2]) or 0
+if ok + failed > tonumber(ARGV[7]) then
+    redis.call("HSET", KEYS[1], "success", math.floor(ok / 2), "failure", math.floor(failed / 2))
+end
+return tripped
+"""
+
+
+class NoAccountAvailableError(Exception):
+    """Every configured account is tripped or on probation."""
+
+
+@dataclass
+class AccountLease:
+    """An account handed out by ``acquire_account``."""
+
+    account: str
+    lease_id: str
+
+
+def _stats_key(account: str) -> str:
+    return f"{ACCOUNT_PREFIX}:stats:{account}"
+
+
+def _circuit_key(account: str) -> str:
+    return f"{ACCOUNT_PREFIX}:circuit:{account}"
+
+
+def _leases_key(account: str) -> str:
+    return f"{ACCOUNT_PREFIX}:leases:{account}"
+
+
+async def acquire_account(
+    redis: Redis,
+    accounts: tuple[str, ...],
+    lease_seconds: float,
+) -> AccountLease:
+    """
+    Lease the healthiest, least loaded account.
+
+    Accounts are weighted by success rate and latency, and by the requests
+    they already serve. Tripped accounts are skipped. The lease counts as
+    in flight until released or until ``lease_seconds`` pass.
+
+    :param redis: redis client.
+    :param accounts: candidate accounts (cookie files).
+    :param lease_seconds: upper bound on how long the account is used.
+    :raises NoAccountAvailableError: if no account can be used.
+    """
+    # Shuffled, so ties don't always go to the same account
+    accounts = tuple(random.sample(accounts, len(accounts)))
+    keys = [ACCOUNT_PROBATION_KEY]
+    for account in accounts:
+        keys += [_stats_key(account), _circuit_key(account), _leases_key(account)]
+    now = time.time()
+    lease_id = uuid4().hex
+    account = await redis.eval(
+        ACQUIRE_SCRIPT,
+        len(keys),
+        *keys,
+        now,
+        now + lease_seconds,
+        lease_id,
+        _DEFAULT_LATENCY,
+        *accounts,
+    )
+    if account is None:
+        raise NoAccountAvailableError("All accounts are resting after failures")
+    return AccountLease(account.decode(), lease_id)
+
+
+async def renew_account(
+    redis: Redis,
+    lease: AccountLease,
+    lease_seconds: float,
+) -> bool:
+    """
+    Extend a lease from ``acquire_account``.
+
+    :param redis: redis client.
+    :param lease: lease to extend.
+    :param lease_seconds: the lease ends this long from now.
+    :return: False if the lease had expired.
+    """
+    renewed = await redis.zadd(
+        _leases_key(lease.account),
+        {lease.lease_id: time.time() + lease_seconds},
+        xx=True,
+        ch=True,
+    )
+    return bool(renewed)
+
+
+async def wait_for_account(
+    redis: Redis,
+    accounts: tuple[str, ...],
+    lease_seconds: float,
+    timeout: float,
+) -> AccountLease:
+    """
+    Lease an account like ``acquire_account``, waiting while all are resting.
+
+    :raises NoAccountAvailableError: if none came back within ``timeout``.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await acquire_account(redis, accounts, lease_seconds)
+        except NoAccountAvailableError:
+            if time.monotonic() >= deadline:
+                raise
+            logger.warning("All accounts are resting, waiting for one")
+            await asyncio.sleep(_WAIT_POLL_SECONDS)
+
+
+async def release_account(
+    redis: Redis,
+    lease: AccountLease,
+    error: BaseException | None = None,
+    account_error: bool = False,
+    latency: float | None = None,
+) -> bool:
+    """
+    Return a leased account and record how it went.
+
+    :param redis: redis client.
+    :param lease: lease from ``acquire_account``.
+    :param error: exception the work failed with, None on success.
+    :param account_error: whether the error is the account's fault
+        (a block or a proxy failure).
+    :param latency: seconds a successful request took, if comparable
+        across accounts (extractions, not whole downloads).
+    :return: True if this failure took the account out of rotation.
+    """
+    if error is None:
+        outcome = "ok"
+    elif account_error:
+        outcome = "failed"
+    else:
+        outcome = "other"
+    tripped = await redis.eval(
+        RELEASE_SCRIPT,
+        4,
+        _stats_key(lease.account),
+        _circuit_key(lease.account),
+        _leases_key(lease.account),
+        ACCOUNT_PROBATION_KEY,
+        lease.lease_id,
+        outcome,
+        "" if latency is None else latency,
+        settings.account_failure_threshold,
+        settings.account_circuit_seconds,
+        lease.account,
+        _STATS_WINDOW,
+    )
+    return bool(tripped)
+
+
+async def accounts_to_probe(redis: Redis) -> list[str]:
+    """Tripped accounts whose rest period is over."""
+    accounts = [
+        member.decode() for member in await redis.smembers(ACCOUNT_PROBATION_KEY)
+    ]
+    return [
+        account for account in accounts if not await redis.exists(_circuit_key(account))
+    ]
+
+
+async def finish_probe(redis: Redis, account: str, passed: bool) -> None:
+    """
+    Put a probed account back into rotation, or rest it for longer.
+
+    :param redis: redis client.
+    :param account: probed account.
+    :param passed: whether the probe succeeded.
+    """
+    if passed:
+        await redis.srem(ACCOUNT_PROBATION_KEY, account)
+        await redis.hset(_stats_key(account), "strikes", 0)
+        return
+    previous = await redis.hget(_stats_key(account), "circuit_seconds")
+    seconds = min(
+        int(previous or settings.account_circuit_seconds) * 2,
+        settings.account_circuit_max_seconds,
+    )
+    await redis.set(_circuit_key(account), "open", ex=seconds)
+    await redis.hset(_stats_key(account), "circuit_seconds", seconds)
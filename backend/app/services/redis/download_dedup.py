@@ -0,0 +1,206 @@
+from dataclasses import dataclass
+from typing import Any
+
+import orjson
+from redis.asyncio import Redis
+
+from app.services.redis.lease import renew_key
+from app.settings import settings
+
+DOWNLOAD_KEY_PREFIX = "download:file"
+# Hash of task id -> request of the tasks waiting for a download
+DOWNLOAD_WAITERS_PREFIX = "download:waiters"
+# Value of a dedup entry while its download is still running
+PENDING_PREFIX = "pending:"
+
+# Claims the dedup entry KEYS[1] for ARGV[1] for ARGV[2] milliseconds,
+# unless another task holds it or its file is done. A task that finds
+# another's claim is added to the waiters hash KEYS[2] (task id ARGV[3] ->
+# request ARGV[4]) for ARGV[5] seconds. Claims start with ARGV[6].
+# Returns {"claimed"}, {"waiting"} or {"file", filename}.
+ACQUIRE_SCRIPT = """
+local value = redis.call("GET", KEYS[1])
+if not value or value == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+    return {"claimed"}
+end
+if string.sub(value, 1, #ARGV[6]) ~= ARGV[6] then
+    return {"file", value}
+end
+redis.call("HSET", KEYS[2], ARGV[3], ARGV[4])
+redis.call("EXPIRE", KEYS[2], ARGV[5])
+return {"waiting"}
+"""
+
+# Stores the finished file ARGV[1] in KEYS[1] for ARGV[2] seconds and
+# takes the waiters hash KEYS[2]. Returns its fields and values.
+COMPLETE_SCRIPT = """
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+local waiters = redis.call("HGETALL", KEYS[2])
+redis.call("DEL", KEYS[2])
+return waiters
+"""
+
+# Drops the claim ARGV[1] on KEYS[1] and takes the waiters hash KEYS[2],
+# unless another task claimed it meanwhile. Returns fields and values.
+RELEASE_SCRIPT = """
+local value = redis.call("GET", KEYS[1])
+if value and value ~= ARGV[1] then
+    return {}
+end
+redis.call("DEL", KEYS[1])
+local waiters = redis.call("HGETALL", KEYS[2])
+redis.call("DEL", KEYS[2])
+return waiters
+"""
+
+# Deletes the entry only if it still holds the expected value
+DELETE_IF_EQUALS_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+@dataclass
+class DownloadClaim:
+    """Outcome of ``acquire_download``."""
+
+    # The caller must download the item
+    claimed: bool
+    # File another task already produced
+    filename: str | None = None
+
+    @property
+    def waiting(self) -> bool:
+        """Another task is downloading the item and serves the caller too."""
+        return not self.claimed and self.filename is None
+
+
+def download_dedup_key(video_key: str, res: str, fmt: str) -> str:
+    """Redis key identifying one downloadable rendition of a video."""
+    return f"{DOWNLOAD_KEY_PREFIX}:{video_key}:{res}:{fmt}"
+
+
+def _waiters_key(key: str) -> str:
+    return f"{DOWNLOAD_WAITERS_PREFIX}:{key.removeprefix(f'{DOWNLOAD_KEY_PREFIX}:')}"
+
+
+def _pending(task_id: str) -> str:
+    return f"{PENDING_PREFIX}{task_id}"
+
+
+def _parse_waiters(raw: list[bytes]) -> dict[str, dict[str, Any]]:
+    return {raw[i].decode(): orjson.loads(raw[i + 1]) for i in range(0, len(raw), 2)}
+
+
+async def acquire_download(
+    redis: Redis,
+    key: str,
+    task_id: str,
+    request: dict[str, Any],
+) -> DownloadClaim:
+    """
+    Claim a download or find the file another task already produced.
+
+    The dedup entry holds ``pending:<task_id>`` while a download runs and
+    the stored filename once it is done. The claim is a short lease the
+    downloading task keeps renewing with ``renew_download``, so the claim of
+    a killed worker is soon free again.
+
+    A task that finds the item being downloaded doesn't wait for it: it is
+    recorded with its ``request`` and handed back by ``complete_download``
+    or ``release_download`` of whichever task finishes the download.
+
+    :param redis: redis client.
+    :param key: key from ``download_dedup_key``.
+    :param task_id: id of the current task.
+    :param request: what the current task needs to be served or requeued.
+    :return: the claim.
+    """
+    while True:
+        result = await redis.eval(
+            ACQUIRE_SCRIPT,
+            2,
+            key,
+            _waiters_key(key),
+            _pending(task_id),
+            int(settings.worker_lease_seconds * 1000),
+            task_id,
+            orjson.dumps(request),
+            settings.download_claim_seconds,
+            PENDING_PREFIX,
+        )
+        outcome = result[0].decode()
+        if outcome == "claimed":
+            return DownloadClaim(claimed=True)
+        if outcome == "waiting":
+            return DownloadClaim(claimed=False)
+
+        filename = result[1].decode()
+        if (settings.download_dir / filename).is_file():
+            return DownloadClaim(claimed=False, filename=filename)
+        # The file was cleaned up before the entry expired
+        await redis.eval(DELETE_IF_EQUALS_SCRIPT, 1, key, filename)
+
+
+async def renew_download(redis: Redis, key: str, task_id: str, seconds: float) -> bool:
+    """
+    Extend the claim of a running download.
+
+    :param redis: redis client.
+    :param key: key from ``download_dedup_key``.
+    :param task_id: id of the task that holds the claim.
+    :param seconds: new TTL of the claim.
+    :return: False if the claim expired or was taken over.
+    """
+    return await renew_key(redis, key, _pending(task_id), seconds)
+
+
+async def complete_download(
+    redis: Redis,
+    key: str,
+    filename: str,
+) -> dict[str, dict[str, Any]]:
+    """
+    Publish a finished download for reuse by later tasks.
+
+    :param redis: redis client.
+    :param key: key from ``download_dedup_key``.
+    :param filename: basename of the stored file.
+    :return: task id -> request of the tasks that waited for it.
+    """
+    waiters = await redis.eval(
+        COMPLETE_SCRIPT,
+        2,
+        key,
+        _waiters_key(key),
+        filename,
+        settings.video_storage_minutes * 60,
+    )
+    return _parse_waiters(waiters)
+
+
+async def release_download(
+    redis: Redis,
+    key: str,
+    task_id: str,
+) -> dict[str, dict[str, Any]]:
+    """
+    Drop a claim after a failed download.
+
+    :param redis: redis client.
+    :param key: key from ``download_dedup_key``.
+    :param task_id: id of the task that holds the claim.
+    :return: task id -> request of the tasks that waited for the download,
+        to be queued again.
+    """
+    waiters = await redis.eval(
+        RELEASE_SCRIPT,
+        2,
+        key,
+        _waiters_key(key),
+        _pending(task_id),
+    )
+    return _parse_waiters(waiters)
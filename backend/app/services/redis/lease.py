@@ -0,0 +1,147 @@
+import asyncio
+from collections.abc import AsyncGenerator, Awaitable, Callable
+from contextlib import asynccontextmanager, suppress
+from uuid import uuid4
+
+from loguru import logger
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.settings import settings
+
+# Extends the TTL of KEYS[1] to ARGV[2] milliseconds, only if it still
+# holds ARGV[1]. Returns 1 if it did.
+RENEW_IF_EQUALS_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+# Deletes KEYS[1] only if it still holds ARGV[1]
+RELEASE_IF_EQUALS_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# How often a task waiting for an exclusive lease tries again
+_WAIT_POLL_SECONDS = 5.0
+
+
+async def acquire_lease(redis: Redis, key: str) -> str | None:
+    """
+    Take an exclusive lease of ``worker_lease_seconds``, if it is free.
+
+    :param redis: redis client.
+    :param key: key of the lease.
+    :return: token for ``release_lease``, None if someone else holds it.
+    """
+    token = uuid4().hex
+    taken = await redis.set(
+        key,
+        token,
+        nx=True,
+        px=int(settings.worker_lease_seconds * 1000),
+    )
+    return token if taken else None
+
+
+async def release_lease(redis: Redis, key: str, token: str) -> None:
+    """
+    Give up a lease taken with ``acquire_lease``.
+
+    :param redis: redis client.
+    :param key: key of the lease.
+    :param token: token returned by ``acquire_lease``.
+    """
+    await redis.eval(RELEASE_IF_EQUALS_SCRIPT, 1, key, token)
+
+
+async def renew_key(redis: Redis, key: str, value: str, seconds: float) -> bool:
+    """
+    Extend a lease stored as a plain key.
+
+    :param redis: redis client.
+    :param key: key of the lease.
+    :param value: value the key holds while the lease is ours.
+    :param seconds: new TTL.
+    :return: False if the lease expired or was taken over.
+    """
+    renewed = await redis.eval(
+        RENEW_IF_EQUALS_SCRIPT, 1, key, value, int(seconds * 1000)
+    )
+    return bool(renewed)
+
+
+@asynccontextmanager
+async def keep_alive(
+    renew: Callable[[], Awaitable[bool]],
+    name: str,
+    lease_seconds: float | None = None,
+) -> AsyncGenerator[None, None]:
+    """
+    Renew a lease in the background while the block runs.
+
+    Leases of running work are short, ``worker_lease_seconds`` unless
+    given, so the work of a killed worker is freed soon, and are renewed
+    three times as often.
+
+    :param renew: coroutine function extending the lease, returns False
+        if it was lost.
+    :param name: what the lease is for, for the logs.
+    :param lease_seconds: length of the lease.
+    """
+    interval = (lease_seconds or settings.worker_lease_seconds) / 3
+
+    async def renew_forever() -> None:
+        lost = False
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await renew()
+            except RedisError as exc:
+                logger.warning(f"Failed to renew the lease of {name}: {exc}")
+                continue
+            if not renewed and not lost:
+                logger.warning(f"Lost the lease of {name}")
+            lost = not renewed
+
+    renewer = asyncio.create_task(renew_forever())
+    try:
+        yield
+    finally:
+        renewer.cancel()
+        with suppress(asyncio.CancelledError):
+            await renewer
+
+
+@asynccontextmanager
+async def hold_lease(redis: Redis, key: str, name: str) -> AsyncGenerator[None, None]:
+    """
+    Hold an exclusive lease for the block, renewed while it runs.
+
+    Waits while someone else holds it: a live holder keeps renewing it,
+    the lease of one that died expires within ``worker_lease_seconds``.
+
+    :param redis: redis client.
+    :param key: key of the lease.
+    :param name: what the lease is for, for the logs.
+    """
+    waited = False
+    while (token := await acquire_lease(redis, key)) is None:
+        if not waited:
+            logger.info(f"Waiting for {name}, it is held elsewhere")
+            waited = True
+        await asyncio.sleep(_WAIT_POLL_SECONDS)
+
+    async def renew() -> bool:
+        return await renew_key(redis, key, token, settings.worker_lease_seconds)
+
+    try:
+        async with keep_alive(renew, name):
+            yield
+    finally:
+        await release_lease(redis, key, token)
@@ -0,0 +1,199 @@
+import re
+import time
+from collections.abc import Awaitable, Callable
+from uuid import uuid4
+
+import orjson
+from redis.asyncio import ConnectionPool, Redis
+
+from app.settings import settings
+
+LINK_CACHE_PREFIX = "link:info"
+
+# Signed CDN URLs (googlevideo and friends) carry their expiry either as a
+# query parameter (?expire=1700000000) or as a path segment (/expire/1700000000/).
+_EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+
+# Deletes the extraction lock only if it is still held by the caller
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# How often waiters re-check the cache in case a notification was lost
+_WAIT_POLL_SECONDS = 1.0
+
+
+class ExtractionFailedError(Exception):
+    """The video's last extraction failed moments ago, it isn't retried yet."""
+
+    def __init__(self, error: str, message: str) -> None:
+        super().__init__(f"{error}: {message}")
+        self.error = error
+
+
+def link_cache_key(video_key: str) -> str:
+    """Redis key for the cached link response of a video."""
+    return f"{LINK_CACHE_PREFIX}:{video_key}"
+
+
+def link_cache_ttl(data: dict) -> int:
+    """
+    Compute how long a link response may be served from cache.
+
+    The response is only useful while every media URL in it is still
+    signed, so the TTL is the earliest ``expire`` found in the URLs minus
+    a margin that leaves clients time to start the download.
+
+    :param data: response of /get_download_link.
+    :return: TTL in seconds, zero or less means "don't cache".
+    """
+    urls = [
+        data.get("url"),
+        (data.get("audio") or {}).get("url"),
+        *(fmt.get("url") for fmt in data.get("resolutions", [])),
+    ]
+    expires = [
+        int(match.group(1)) for url in urls if url and (match := _EXPIRE_RE.search(url))
+    ]
+    if not expires:
+        return settings.link_cache_default_seconds
+
+    ttl = min(expires) - int(time.time()) - settings.link_cache_expiry_margin_seconds
+    return min(ttl, settings.link_cache_max_seconds)
+
+
+def link_error_key(video_key: str) -> str:
+    """Redis key for the last failed extraction of a video."""
+    return f"{LINK_CACHE_PREFIX}:error:{video_key}"
+
+
+async def get_cached_link(redis: Redis, video_key: str) -> dict | None:
+    """
+    Return the cached link response for a video, if any.
+
+    :param redis: redis client.
+    :param video_key: video identity from ``video_key``.
+    :return: cached response or None.
+    """
+    raw = await redis.get(link_cache_key(video_key))
+    if raw is None:
+        return None
+    return orjson.loads(raw)
+
+
+async def cache_link(redis: Redis, video_key: str, data: dict) -> None:
+    """
+    Store a link response until its signed URLs are about to expire.
+
+    :param redis: redis client.
+    :param video_key: video identity from ``video_key``.
+    :param data: response of /get_download_link.
+    """
+    ttl = link_cache_ttl(data)
+    if ttl <= 0:
+        return
+    await redis.set(link_cache_key(video_key), orjson.dumps(data), ex=ttl)
+
+
+async def _get_known_link(redis: Redis, video_key: str) -> dict | None:
+    """Cached link response, raises the error of a failure remembered instead."""
+    cached = await get_cached_link(redis, video_key)
+    if cached is not None:
+        return cached
+    failure = await redis.get(link_error_key(video_key))
+    if failure is not None:
+        raise ExtractionFailedError(**orjson.loads(failure))
+    return None
+
+
+async def get_or_extract_link(
+    redis_pool: ConnectionPool,
+    video_key: str,
+    extract: Callable[[], Awaitable[dict]],
+    uncached_errors: tuple[type[Exception], ...] = (),
+    timeout: float | None = None,
+) -> dict:
+    """
+    Return the link response for a video, extracting it at most once at a time.
+
+    Concurrent requests for the same video across all workers are coalesced:
+    the first caller takes a short Redis lock and runs ``extract``, the rest
+    subscribe to a channel and get the result published by the lock holder.
+    If the holder fails, its error is remembered for
+    ``link_cache_error_seconds`` and raised to the waiters and to new
+    requests in the meantime, so a broken video doesn't take one account
+    after another. Errors in ``uncached_errors`` say nothing about the video
+    (e.g. no free slot), after those the waiters compete for the lock again.
+
+    :param redis_pool: redis connection pool.
+    :param video_key: video identity from ``video_key``.
+    :param extract: coroutine function that runs the actual extraction.
+    :param uncached_errors: extraction errors that are not remembered.
+    :param timeout: longest ``extract`` may take, including any wait for
+        its slots, ``extraction_timeout_seconds`` by default. Waiters give
+        up after this long.
+    :raises TimeoutError: if no result arrived in time.
+    :raises ExtractionFailedError: if the video failed to extract just before.
+    :return: response of /get_download_link.
+    """
+    lock_key = f"{LINK_CACHE_PREFIX}:lock:{video_key}"
+    channel = f"{LINK_CACHE_PREFIX}:ready:{video_key}"
+    if timeout is None:
+        timeout = settings.extraction_timeout_seconds
+    # The holder may legitimately take the whole timeout
+    lock_seconds = int(timeout) + 5
+    deadline = time.monotonic() + timeout
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        # Most requests are cache hits, they don't need a subscription
+        cached = await _get_known_link(redis, video_key)
+        if cached is not None:
+            return cached
+
+        async with redis.pubsub() as pubsub:
+            # Subscribe before looking at the lock, so the holder can't
+            # publish between our check and the subscription.
+            await pubsub.subscribe(channel)
+
+            while True:
+                cached = await _get_known_link(redis, video_key)
+                if cached is not None:
+                    return cached
+
+                token = uuid4().hex
+                if await redis.set(lock_key, token, nx=True, ex=lock_seconds):
+                    payload = b""
+                    try:
+                        data = await extract()
+                        payload = orjson.dumps(data)
+                        await cache_link(redis, video_key, data)
+                        return data
+                    except uncached_errors:
+                        raise
+                    except Exception as exc:
+                        if settings.link_cache_error_seconds > 0:
+                            failure = {"error": type(exc).__name__, "message": str(exc)}
+                            await redis.set(
+                                link_error_key(video_key),
+                                orjson.dumps(failure),
+                                ex=settings.link_cache_error_seconds,
+                            )
+                        raise
+                    finally:
+                        await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+                        # An empty payload tells waiters the extraction
+                        # failed, they find the error or the free lock
+                        await redis.publish(channel, payload)
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=min(remaining, _WAIT_POLL_SECONDS),
+                )
+                if message and message["data"]:
+                    return orjson.loads(message["data"])
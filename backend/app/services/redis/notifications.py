@@ -0,0 +1,147 @@
+import random
+import time
+
+from redis.asyncio import Redis
+
+from app.settings import settings
+
+NOTIFY_PREFIX = "notify"
+# Hash of task id -> video URL waiting to be sent to the bot
+NOTIFY_PENDING_KEY = f"{NOTIFY_PREFIX}:pending"
+# Sorted set of task id -> unix time the next attempt is due
+NOTIFY_DUE_KEY = f"{NOTIFY_PREFIX}:due"
+# Hash of task id -> attempts made so far
+NOTIFY_ATTEMPTS_KEY = f"{NOTIFY_PREFIX}:attempts"
+
+# Queues a notification unless the task's was already queued or sent.
+# KEYS: pending, due, sent marker. Returns 1 if queued.
+QUEUE_SCRIPT = """
+if redis.call("EXISTS", KEYS[3]) == 1 then
+    return 0
+end
+if redis.call("HSETNX", KEYS[1], ARGV[1], ARGV[2]) == 0 then
+    return 0
+end
+redis.call("ZADD", KEYS[2], ARGV[3], ARGV[1])
+return 1
+"""
+
+# Takes up to ARGV[2] due notifications and pushes their due time ARGV[3]
+# seconds ahead, so concurrent senders never get the same one and a sender
+# that dies only delays it. KEYS: due, pending, attempts.
+# Returns task id, URL and attempts for each.
+CLAIM_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+local claimed = {}
+for _, task_id in ipairs(due) do
+    local url = redis.call("HGET", KEYS[2], task_id)
+    if url then
+        redis.call("ZADD", KEYS[1], ARGV[1] + ARGV[3], task_id)
+        table.insert(claimed, task_id)
+        table.insert(claimed, url)
+        table.insert(claimed, redis.call("HGET", KEYS[3], task_id) or "0")
+    else
+        redis.call("ZREM", KEYS[1], task_id)
+    end
+end
+return claimed
+"""
+
+# How long a claimed notification stays with its sender
+_CLAIM_SECONDS = 60
+# Sent task ids are remembered this long, so a retried download task
+# doesn't notify the bot twice
+_SENT_SECONDS = 24 * 60 * 60
+
+
+def _sent_key(task_id: str) -> str:
+    return f"{NOTIFY_PREFIX}:sent:{task_id}"
+
+
+async def queue_notification(redis: Redis, task_id: str, video_url: str) -> bool:
+    """
+    Queue a finished task for the bot.
+
+    :param redis: redis client.
+    :param task_id: download task id, at most one notification is sent per id.
+    :param video_url: URL of the stored video.
+    :return: False if the task's notification was already queued or sent.
+    """
+    queued = await redis.eval(
+        QUEUE_SCRIPT,
+        3,
+        NOTIFY_PENDING_KEY,
+        NOTIFY_DUE_KEY,
+        _sent_key(task_id),
+        task_id,
+        video_url,
+        time.time(),
+    )
+    return bool(queued)
+
+
+async def claim_notifications(
+    redis: Redis,
+    limit: int,
+) -> list[tuple[str, str, int]]:
+    """
+    Take due notifications for sending.
+
+    :param redis: redis client.
+    :param limit: most notifications to take.
+    :return: (task id, video URL, attempts so far) for each.
+    """
+    claimed = await redis.eval(
+        CLAIM_SCRIPT,
+        3,
+        NOTIFY_DUE_KEY,
+        NOTIFY_PENDING_KEY,
+        NOTIFY_ATTEMPTS_KEY,
+        time.time(),
+        limit,
+        _CLAIM_SECONDS,
+    )
+    return [
+        (claimed[i].decode(), claimed[i + 1].decode(), int(claimed[i + 2]))
+        for i in range(0, len(claimed), 3)
+    ]
+
+
+async def finish_notifications(redis: Redis, task_ids: list[str]) -> None:
+    """
+    Forget notifications that were sent, or given up on.
+
+    :param redis: redis client.
+    :param task_ids: their task ids.
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hdel(NOTIFY_PENDING_KEY, *task_ids)
+        pipe.hdel(NOTIFY_ATTEMPTS_KEY, *task_ids)
+        pipe.zrem(NOTIFY_DUE_KEY, *task_ids)
+        for task_id in task_ids:
+            pipe.set(_sent_key(task_id), 1, ex=_SENT_SECONDS)
+        await pipe.execute()
+
+
+async def retry_notifications(
+    redis: Redis,
+    notifications: list[tuple[str, int]],
+) -> None:
+    """
+    Schedule failed notifications again with exponential backoff.
+
+    :param redis: redis client.
+    :param notifications: (task id, attempts before this one) for each.
+    """
+    now = time.time()
+    async with redis.pipeline(transaction=True) as pipe:
+        for task_id, attempts in notifications:
+            delay = min(
+                settings.notify_retry_seconds * 2**attempts,
+                settings.notify_retry_max_seconds,
+            )
+            # Jitter, so a bot coming back up isn't hit by everything at once
+            delay *= random.uniform(0.5, 1.0)
+            pipe.hset(NOTIFY_ATTEMPTS_KEY, task_id, attempts + 1)
+            pipe.zadd(NOTIFY_DUE_KEY, {task_id: now + delay})
+        await pipe.execute()
@@ -0,0 +1,57 @@
+import hashlib
+
+from redis.asyncio import Redis
+
+from app.settings import settings
+
+BACKOFF_PREFIX = "backoff:download"
+# Each level halves the parallel fragment downloads through a proxy
+MAX_BACKOFF_LEVEL = 3
+
+# Lowers the level after a success, never below zero
+DECREMENT_SCRIPT = """
+local level = tonumber(redis.call("GET", KEYS[1]) or "0")
+if level > 0 then
+    redis.call("DECR", KEYS[1])
+end
+return level
+"""
+
+
+def _backoff_key(proxy: str | None) -> str:
+    # The URL holds credentials, keep it out of key names
+    name = hashlib.sha1(proxy.encode()).hexdigest()[:16] if proxy else "direct"
+    return f"{BACKOFF_PREFIX}:{name}"
+
+
+async def backoff_level(redis: Redis, proxy: str | None) -> int:
+    """
+    How far downloads through a proxy are scaled back, 0 for not at all.
+
+    :param redis: redis client.
+    :param proxy: proxy URL, None for direct downloads.
+    """
+    level = await redis.get(_backoff_key(proxy))
+    return min(int(level or 0), MAX_BACKOFF_LEVEL)
+
+
+async def record_download(redis: Redis, proxy: str | None, failed: bool) -> None:
+    """
+    Raise the backoff level after a proxy failure, lower it after a success.
+
+    Levels expire download_backoff_seconds after the last failure.
+
+    :param redis: redis client.
+    :param proxy: proxy URL, None for direct downloads.
+    :param failed: whether the proxy or the site turned the download away.
+    """
+    key = _backoff_key(proxy)
+    if not failed:
+        await redis.eval(DECREMENT_SCRIPT, 1, key)
+        return
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.incr(key)
+        pipe.expire(key, settings.download_backoff_seconds)
+        level, _ = await pipe.execute()
+    if level > MAX_BACKOFF_LEVEL:
+        await redis.set(key, MAX_BACKOFF_LEVEL, ex=settings.download_backoff_seconds)
@@ -1,9 +1,14 @@
+import math
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
 
 from fastapi import HTTPException, Request, status
 from redis.asyncio import ConnectionPool, Redis
 
+from app.services.metrics import metrics
+from app.settings import settings
+
 # Lua script for atomic sliding window counter
 # This runs atomically on Redis, preventing race conditions
 SLIDING_WINDOW_SCRIPT = """
@@ -56,17 +61,59 @@ class RateLimiter:
     - Atomic operations via Lua scripting (no race conditions)
     - Memory efficient (only stores 2 counters per key)
     - Configurable per-endpoint limits
+
+    One instance lives for the whole application (``app.state.rate_limiter``).
+    The script is registered once: its SHA is computed locally, every check
+    is a single EVALSHA, and the script is only (re)loaded when Redis answers
+    NOSCRIPT, e.g. after a restart or SCRIPT FLUSH.
+
+    Denials are also remembered in a small in-process LRU until the
+    ``retry_after`` Redis returned runs out, so clients that keep hammering
+    after a 429 are rejected without a Redis round trip. This matches the
+    script: denied requests never increment the counters there either, and
+    the local entry expires exactly when the client was told to retry.
     """
 
-    def __init__(self, redis_pool: ConnectionPool) -> None:
+    def __init__(
+        self,
+        redis_pool: ConnectionPool,
+        local_cache_size: int = settings.rate_limit_local_cache_size,
+    ) -> None:
         self.redis_pool = redis_pool
-        self._script_sha: str | None = None
+        self._redis = Redis(connection_pool=redis_pool)
+        self._script = self._redis.register_script(SLIDING_WINDOW_SCRIPT)
+        self._local_cache_size = local_cache_size
+        # key -> (monotonic time the window reopens, last known count)
+        self._denied: OrderedDict[str, tuple[float, int]] = OrderedDict()
+
+    def _check_local(self, key: str) -> RateLimitResult | None:
+        """Answer from the local denial cache, if the key is still blocked."""
+        denied = self._denied.get(key)
+        if denied is None:
+            return None
+        reopens_at, current_count = denied
+        remaining = reopens_at - time.monotonic()
+        if remaining <= 0:
+            del self._denied[key]
+            return None
+        self._denied.move_to_end(key)
+        return RateLimitResult(
+            allowed=False,
+            current_count=current_count,
+            retry_after=math.ceil(remaining),
+        )
 
-    async def _get_script_sha(self, redis: Redis) -> str:
-        """Load and cache the Lua script SHA."""
-        if self._script_sha is None:
-            self._script_sha = await redis.script_load(SLIDING_WINDOW_SCRIPT)
-        return self._script_sha
+    def _remember_denial(self, key: str, result: RateLimitResult) -> None:
+        """Block the key locally until Redis would consider retrying it."""
+        if result.retry_after <= 0 or self._local_cache_size <= 0:
+            return
+        self._denied[key] = (
+            time.monotonic() + result.retry_after,
+            result.current_count,
+        )
+        self._denied.move_to_end(key)
+        while len(self._denied) > self._local_cache_size:
+            self._denied.popitem(last=False)
 
     async def check(
         self,
@@ -85,37 +132,29 @@ class RateLimiter:
         Returns:
             RateLimitResult with allowed status and metadata
         """
-        async with Redis(connection_pool=self.redis_pool) as redis:
-            now = time.time()
-            script_sha = await self._get_script_sha(redis)
-
-            try:
-                result = await redis.evalsha(
-                    script_sha,
-                    1,  # number of keys
-                    key,
-                    str(now),
-                    str(window_seconds),
-                    str(limit),
-                )
-            except Exception:
-                # Script not loaded, reload it
-                self._script_sha = None
-                script_sha = await self._get_script_sha(redis)
-                result = await redis.evalsha(
-                    script_sha,
-                    1,
-                    key,
-                    str(now),
-                    str(window_seconds),
-                    str(limit),
-                )
-
-            return RateLimitResult(
-                allowed=bool(result[0]),
-                current_count=int(result[1]),
-                retry_after=int(result[2]),
-            )
+        local = self._check_local(key)
+        if local is not None:
+            return local
+
+        # AsyncScript runs EVALSHA and handles NOSCRIPT by loading the script
+        # and retrying; any other error propagates.
+        result = await self._script(
+            keys=[key],
+            args=[str(time.time()), str(window_seconds), str(limit)],
+        )
+
+        limit_result = RateLimitResult(
+            allowed=bool(result[0]),
+            current_count=int(result[1]),
+            retry_after=int(result[2]),
+        )
+        if not limit_result.allowed:
+            self._remember_denial(key, limit_result)
+        return limit_result
+
+    async def close(self) -> None:
+        """Release the client. The pool itself is closed by the redis lifespan."""
+        await self._redis.aclose()
 
 
 @dataclass
@@ -138,6 +177,13 @@ DOWNLOAD_LIMIT = RateLimitConfig(
     key_prefix="ratelimit:download",
 )
 
+# Players send a request per seek, one stream takes many
+STREAM_LIMIT = RateLimitConfig(
+    requests_per_window=120,  # 120 stream requests
+    window_seconds=60,  # per minute
+    key_prefix="ratelimit:stream",
+)
+
 INFO_LIMIT = RateLimitConfig(
     requests_per_window=30,  # 30 info requests
     window_seconds=60,  # per minute
@@ -162,8 +208,7 @@ async def check_rate_limit(
 
     Raises HTTPException 429 if rate limit exceeded.
     """
-    redis_pool: ConnectionPool = request.app.state.redis_pool
-    limiter = RateLimiter(redis_pool)
+    limiter: RateLimiter = request.app.state.rate_limiter
 
     client_ip = get_client_ip(request)
     key = config.get_key(client_ip)
@@ -180,6 +225,11 @@ async def check_rate_limit(
         0, config.requests_per_window - result.current_count
     )
     request.state.rate_limit_reset = result.retry_after
+    metrics.inc(
+        "rate_limit_checks_total",
+        limit=config.key_prefix,
+        result="allowed" if result.allowed else "denied",
+    )
 
     if not result.allowed:
         raise HTTPException(
@@ -194,7 +244,11 @@ async def check_rate_limit(
         )
 
 
-
 async def rate_limit_download(request: Request) -> None:
     """Rate limit dependency for download endpoint."""
     await check_rate_limit(request, DOWNLOAD_LIMIT)
+
+
+async def rate_limit_stream(request: Request) -> None:
+    """Rate limit dependency for stream endpoint."""
+    await check_rate_limit(request, STREAM_LIMIT)
@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import random
+import time
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from app.services.redis.lease import keep_alive
+from app.settings import settings
+
+SEMAPHORE_PREFIX = "semaphore"
+
+# Takes a slot in every semaphore in KEYS or in none of them. Each key is
+# a sorted set of lease id -> expiry, ARGV[4:] are the limits. Expired
+# leases (holders that died) are dropped first. Returns 1 on success.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+    if redis.call("ZCARD", key) >= tonumber(ARGV[i + 3]) then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call("ZADD", key, ARGV[2], ARGV[3])
+end
+return 1
+"""
+
+# Moves the expiry of lease ARGV[2] to ARGV[1] in every semaphore in KEYS.
+# Returns 0 if it had expired in one of them.
+RENEW_SCRIPT = """
+local renewed = 1
+for _, key in ipairs(KEYS) do
+    if redis.call("ZADD", key, "XX", "CH", ARGV[1], ARGV[2]) == 0 then
+        renewed = 0
+    end
+end
+return renewed
+"""
+
+# Waiting holders check again after a random delay up to this long
+_POLL_SECONDS = 1.0
+
+
+class ConcurrencyLimitError(Exception):
+    """No slot became free in time."""
+
+
+def proxy_semaphore(kind: str, proxy: str) -> str:
+    """Semaphore key for a proxy. The URL is hashed, it holds credentials."""
+    digest = hashlib.sha1(proxy.encode()).hexdigest()[:16]
+    return f"{SEMAPHORE_PREFIX}:{kind}:proxy:{digest}"
+
+
+def site_semaphore(kind: str, site: str) -> str:
+    """Semaphore key for a site (yt-dlp extractor)."""
+    return f"{SEMAPHORE_PREFIX}:{kind}:site:{site}"
+
+
+def download_limits(proxy: str | None, site: str) -> dict[str, int]:
+    """Semaphores a download of ``site`` through ``proxy`` must hold."""
+    return _limits(
+        "download",
+        proxy,
+        settings.proxy_download_limit,
+        site,
+        settings.site_download_limits.get(site, settings.site_download_limit_default),
+    )
+
+
+def extraction_limits(proxy: str | None, site: str) -> dict[str, int]:
+    """Semaphores a link extraction of ``site`` through ``proxy`` must hold."""
+    return _limits(
+        "extraction",
+        proxy,
+        settings.proxy_extraction_limit,
+        site,
+        settings.site_extraction_limits.get(
+            site,
+            settings.site_extraction_limit_default,
+        ),
+    )
+
+
+def _limits(
+    kind: str,
+    proxy: str | None,
+    proxy_limit: int,
+    site: str,
+    site_limit: int,
+) -> dict[str, int]:
+    limits = {}
+    if proxy and proxy_limit > 0:
+        limits[proxy_semaphore(kind, proxy)] = proxy_limit
+    if site_limit > 0:
+        limits[site_semaphore(kind, site)] = site_limit
+    return limits
+
+
+async def acquire_slots(
+    redis: Redis,
+    limits: dict[str, int],
+    lease_seconds: float,
+) -> str | None:
+    """
+    Take a slot in all given semaphores at once.
+
+    :param redis: redis client.
+    :param limits: semaphore key -> number of slots.
+    :param lease_seconds: the slots free themselves after this long.
+    :return: lease id for ``release_slots``, or None if one is full.
+    """
+    lease_id = uuid4().hex
+    now = time.time()
+    acquired = await redis.eval(
+        ACQUIRE_SCRIPT,
+        len(limits),
+        *limits.keys(),
+        now,
+        now + lease_seconds,
+        lease_id,
+        *limits.values(),
+    )
+    return lease_id if acquired else None
+
+
+async def renew_slots(
+    redis: Redis,
+    keys: list[str],
+    lease_id: str,
+    lease_seconds: float,
+) -> bool:
+    """
+    Extend slots taken with ``acquire_slots``.
+
+    :param redis: redis client.
+    :param keys: semaphore keys the slots were taken in.
+    :param lease_id: lease id returned by ``acquire_slots``.
+    :param lease_seconds: the slots free themselves this long from now.
+    :return: False if the lease had expired.
+    """
+    renewed = await redis.eval(
+        RENEW_SCRIPT,
+        len(keys),
+        *keys,
+        time.time() + lease_seconds,
+        lease_id,
+    )
+    return bool(renewed)
+
+
+async def release_slots(redis: Redis, keys: list[str], lease_id: str) -> None:
+    """
+    Free slots taken with ``acquire_slots``.
+
+    :param redis: redis client.
+    :param keys: semaphore keys the slots were taken in.
+    :param lease_id: lease id returned by ``acquire_slots``.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.zrem(key, lease_id)
+        await pipe.execute()
+
+
+@asynccontextmanager
+async def hold_slots(
+    redis: Redis,
+    limits: dict[str, int],
+    lease_seconds: float,
+    timeout: float | None = None,
+) -> AsyncGenerator[None, None]:
+    """
+    Wait for a slot in all given semaphores and hold them for the block.
+
+    The lease is renewed in the background for as long as the block runs,
+    so ``lease_seconds`` only needs to cover a holder that died.
+
+    :param redis: redis client.
+    :param limits: semaphore key -> number of slots.
+    :param lease_seconds: the slots free themselves this long after the
+        holder stopped renewing them.
+    :param timeout: seconds to wait, None to wait as long as it takes.
+    :raises ConcurrencyLimitError: if no slot became free within timeout.
+    """
+    if not limits:
+        yield
+        return
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    waited = False
+    while (lease_id := await acquire_slots(redis, limits, lease_seconds)) is None:
+        if deadline is not None and time.monotonic() >= deadline:
+            raise ConcurrencyLimitError(f"No free slot in {', '.join(limits)}")
+        if not waited:
+            logger.info(f"Waiting for a free slot in {', '.join(limits)}")
+            waited = True
+        await asyncio.sleep(random.uniform(_POLL_SECONDS / 2, _POLL_SECONDS))
+
+    async def renew() -> bool:
+        return await renew_slots(redis, list(limits), lease_id, lease_seconds)
+
+    try:
+        async with keep_alive(renew, ", ".join(limits), lease_seconds):
+            yield
+    finally:
+        await release_slots(redis, list(limits), lease_id)
@@ -0,0 +1,237 @@
+import time
+from collections.abc import AsyncGenerator
+from typing import Any
+
+import orjson
+from loguru import logger
+from redis import Redis as SyncRedis
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import RedisError
+
+from app.services.redis.task_status import (
+    get_task_status,
+    stage_status,
+    status_script_args,
+)
+from app.settings import settings
+
+PROGRESS_PREFIX = "task:progress"
+
+# Stages after which nothing else is published for a task
+FINAL_STAGES = {"done", "failed"}
+
+# yt-dlp postprocessors we report (by the name in their hook status,
+# without the "FFmpeg" prefix), by the stage they represent
+_POSTPROCESSOR_STAGES = {
+    "Merger": "merge",
+    "VideoConvertor": "convert",
+    "VideoRemuxer": "remux",
+}
+
+
+def progress_key(task_id: str) -> str:
+    """Redis key (and pub/sub channel) with the progress of a task."""
+    return f"{PROGRESS_PREFIX}:{task_id}"
+
+
+class ProgressPublisher:
+    """
+    Publishes yt-dlp progress of one task to Redis.
+
+    Meant to be used from the download process: ``hook`` and
+    ``postprocessor_hook`` go straight into yt-dlp's ``progress_hooks``
+    and ``postprocessor_hooks``. Download updates are throttled to one per
+    ``progress_interval_seconds``, stage changes are always published.
+    Every event is stored as the latest snapshot and sent to the task's
+    pub/sub channel, and stage changes move the task's status record.
+    Time spent in each postprocessing stage is collected in
+    ``stage_seconds``.
+    """
+
+    def __init__(self, task_id: str) -> None:
+        self.task_id = task_id
+        self.key = progress_key(task_id)
+        self.stage_seconds: dict[str, float] = {}
+        self._redis = SyncRedis.from_url(str(settings.redis_url))
+        self._stage: str | None = None
+        self._last_sent = 0.0
+        self._stage_started: dict[str, float] = {}
+
+    def publish(self, event: dict[str, Any]) -> None:
+        """
+        Store and broadcast a progress event.
+
+        Progress is best-effort: a Redis error is logged and the event is
+        dropped rather than failing the download it is reported from.
+
+        :param event: event with at least a "stage" field.
+        """
+        payload = orjson.dumps(event)
+        status = stage_status(event) if event["stage"] != self._stage else None
+        try:
+            with self._redis.pipeline(transaction=False) as pipe:
+                pipe.set(self.key, payload, ex=settings.video_storage_minutes * 60)
+                pipe.publish(self.key, payload)
+                if status is not None:
+                    pipe.eval(*status_script_args(self.task_id, *status))
+                pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Failed to publish the progress of {self.task_id}: {exc}")
+        # Throttled as if it was sent, so a dead Redis isn't hammered
+        self._stage = event["stage"]
+        self._last_sent = time.monotonic()
+
+    def hook(self, status: dict[str, Any]) -> None:
+        """yt-dlp progress hook."""
+        if status["status"] != "downloading":
+            return
+        if (
+            self._stage == "download"
+            and time.monotonic() - self._last_sent < settings.progress_interval_seconds
+        ):
+            return
+        self.publish(
+            {
+                "stage": "download",
+                "downloaded_bytes": status.get("downloaded_bytes"),
+                "total_bytes": status.get("total_bytes")
+                or status.get("total_bytes_estimate"),
+                "speed": status.get("speed"),
+                "eta": status.get("eta"),
+            }
+        )
+
+    def postprocessor_hook(self, status: dict[str, Any]) -> None:
+        """yt-dlp postprocessor hook."""
+        stage = _POSTPROCESSOR_STAGES.get(status.get("postprocessor", ""))
+        if stage is None:
+            return
+        if status["status"] == "started":
+            self._stage_started[stage] = time.monotonic()
+            if stage != self._stage:
+                self.publish({"stage": stage})
+        elif status["status"] == "finished" and stage in self._stage_started:
+            elapsed = time.monotonic() - self._stage_started.pop(stage)
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + elapsed
+
+    def close(self) -> None:
+        """Close the Redis connection."""
+        self._redis.close()
+
+
+async def publish_progress(redis: Redis, task_id: str, event: dict[str, Any]) -> None:
+    """
+    Store and broadcast a progress event from async code.
+
+    :param redis: redis client.
+    :param task_id: id of the task.
+    :param event: event with at least a "stage" field.
+    """
+    key = progress_key(task_id)
+    payload = orjson.dumps(event)
+    status = stage_status(event)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.set(key, payload, ex=settings.video_storage_minutes * 60)
+        pipe.publish(key, payload)
+        if status is not None:
+            pipe.eval(*status_script_args(task_id, *status))
+        await pipe.execute()
+
+
+async def stream_progress(
+    redis_pool: ConnectionPool,
+    task_id: str,
+) -> AsyncGenerator[bytes | None, None]:
+    """
+    Follow the progress of a task.
+
+    Yields the latest snapshot first and then every new event until the
+    task is done or failed, or for at most ``progress_max_stream_seconds``
+    (clients reconnect and get the snapshot again). Once the snapshot
+    expired, a finished task's final event is rebuilt from its status
+    record. Yields None every ``progress_heartbeat_seconds`` without
+    events, so callers can keep idle connections alive.
+
+    :param redis_pool: redis connection pool.
+    :param task_id: id of the task.
+    :yield: JSON encoded events or None.
+    """
+    key = progress_key(task_id)
+    deadline = time.monotonic() + settings.progress_max_stream_seconds
+    async with Redis(connection_pool=redis_pool) as redis:
+        async with redis.pubsub() as pubsub:
+            # Subscribe before reading the snapshot so nothing slips through
+            await pubsub.subscribe(key)
+            snapshot = await redis.get(key)
+            if snapshot is None:
+                record = await get_task_status(redis, task_id)
+                if record is not None and record["status"] in FINAL_STAGES:
+                    fields = ("url", "error")
+                    yield orjson.dumps(
+                        {
+                            "stage": record["status"],
+                            **{name: record[name] for name in fields if name in record},
+                        },
+                    )
+                    return
+            else:
+                yield snapshot
+                if orjson.loads(snapshot)["stage"] in FINAL_STAGES:
+                    return
+
+            while (remaining := deadline - time.monotonic()) > 0:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=min(remaining, settings.progress_heartbeat_seconds),
+                )
+                if message is None:
+                    yield None
+                    continue
+                yield message["data"]
+                if orjson.loads(message["data"])["stage"] in FINAL_STAGES:
+                    return
+
+
+async def wait_for_task_url(
+    redis_pool: ConnectionPool,
+    task_id: str,
+    timeout: float,
+) -> dict[str, Any] | None:
+    """
+    Wait until a task has a video URL or fails.
+
+    Sleeps on the task's progress channel instead of polling, so a waiting
+    client costs one subscription and is woken as soon as the task
+    publishes its final event.
+
+    :param redis_pool: redis connection pool.
+    :param task_id: id of the task.
+    :param timeout: maximum time to wait in seconds.
+    :return: final event ({"stage": "done", "url": ...} or
+        {"stage": "failed"}), or None on timeout.
+    """
+    key = progress_key(task_id)
+    deadline = time.monotonic() + timeout
+    async with Redis(connection_pool=redis_pool) as redis:
+        async with redis.pubsub() as pubsub:
+            await pubsub.subscribe(key)
+
+            url = await redis.get(f"task:url:{task_id}")
+            if url is not None:
+                return {"stage": "done", "url": url.decode()}
+            snapshot = await redis.get(key)
+            if snapshot is not None and orjson.loads(snapshot)["stage"] == "failed":
+                return {"stage": "failed"}
+
+            while (remaining := deadline - time.monotonic()) > 0:
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=remaining,
+                )
+                if message is None:
+                    # Subscription confirmations come back as None as well
+                    continue
+                event = orjson.loads(message["data"])
+                if event["stage"] in FINAL_STAGES:
+                    return event
+    return None
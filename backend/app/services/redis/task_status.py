@@ -0,0 +1,127 @@
+import time
+from typing import Any
+
+from redis.asyncio import Redis
+
+from app.settings import settings
+
+STATUS_PREFIX = "task:status"
+
+# Statuses after which a task's record doesn't change anymore
+FINAL_STATUSES = {"done", "failed"}
+
+# Status of a task by the progress stage it publishes
+_STAGE_STATUSES = {
+    "extract": "extracting",
+    "download": "downloading",
+    "merge": "merging",
+    "convert": "merging",
+    "remux": "merging",
+    "transcode": "transcoding",
+    "done": "done",
+    "failed": "failed",
+}
+# Event fields copied into the record
+_EVENT_FIELDS = ("url", "error")
+# Record fields that hold unix times
+_TIME_FIELDS = {
+    "updated_at",
+    *(f"{status}_at" for status in {"queued", *_STAGE_STATUSES.values()}),
+}
+
+# Moves a task to status ARGV[1] at time ARGV[2] and sets the fields in
+# ARGV[4:], unless it already finished. The record expires ARGV[3]
+# seconds after its last change. Returns 1 if it was updated.
+SET_STATUS_SCRIPT = """
+local current = redis.call("HGET", KEYS[1], "status")
+if current == "done" or current == "failed" then
+    return 0
+end
+redis.call("HSET", KEYS[1], "status", ARGV[1], ARGV[1] .. "_at", ARGV[2], "updated_at", ARGV[2])
+for i = 4, #ARGV, 2 do
+    redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call("EXPIRE", KEYS[1], ARGV[3])
+return 1
+"""
+
+
+def task_status_key(task_id: str) -> str:
+    """Redis hash with the status record of a task."""
+    return f"{STATUS_PREFIX}:{task_id}"
+
+
+def status_script_args(
+    task_id: str,
+    status: str,
+    fields: dict[str, Any],
+) -> tuple[Any, ...]:
+    """
+    Arguments of ``SET_STATUS_SCRIPT`` for ``eval``.
+
+    Lets pipelines (and the synchronous client of the download process)
+    update a record together with other commands.
+    """
+    extra = [item for name, value in fields.items() for item in (name, value)]
+    return (
+        SET_STATUS_SCRIPT,
+        1,
+        task_status_key(task_id),
+        status,
+        time.time(),
+        settings.task_status_seconds,
+        *extra,
+    )
+
+
+def stage_status(event: dict[str, Any]) -> tuple[str, dict[str, Any]] | None:
+    """
+    Status and record fields for a progress event.
+
+    :param event: progress event with a "stage" field.
+    :return: None for stages that don't change the status.
+    """
+    status = _STAGE_STATUSES.get(event["stage"])
+    if status is None:
+        return None
+    fields = {
+        name: event[name] for name in _EVENT_FIELDS if event.get(name) is not None
+    }
+    return status, fields
+
+
+async def set_task_status(
+    redis: Redis,
+    task_id: str,
+    status: str,
+    **fields: Any,
+) -> bool:
+    """
+    Move a task to a new status, unless it already finished.
+
+    :param redis: redis client.
+    :param task_id: id of the task.
+    :param status: new status.
+    :param fields: more fields to store in the record.
+    :return: False if the task had finished already.
+    """
+    return bool(await redis.eval(*status_script_args(task_id, status, fields)))
+
+
+async def get_task_status(redis: Redis, task_id: str) -> dict[str, Any] | None:
+    """
+    Read the status record of a task.
+
+    :param redis: redis client.
+    :param task_id: id of the task.
+    :return: status, ``<status>_at`` unix times, and the url or the error
+        class once the task is done or failed. None for unknown tasks.
+    """
+    raw = await redis.hgetall(task_status_key(task_id))
+    if not raw:
+        return None
+    record: dict[str, Any] = {}
+    for name, value in raw.items():
+        name = name.decode()
+        record[name] = float(value) if name in _TIME_FIELDS else value.decode()
+    return record
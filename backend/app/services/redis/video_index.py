@@ -0,0 +1,216 @@
+import asyncio
+import shutil
+import time
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from app.settings import settings
+
+# Sorted set of stored video filename -> unix time it expires at
+VIDEO_EXPIRY_KEY = "videos:expiry"
+# Sorted set of filename -> unix time it was last served (or stored)
+VIDEO_ACCESS_KEY = "videos:access"
+# Hash of filename -> size in bytes
+VIDEO_SIZE_KEY = "videos:size"
+# Total size of all indexed videos
+VIDEO_BYTES_KEY = "videos:bytes"
+
+# Takes least recently served files out of the index until at least
+# ARGV[1] bytes are freed. Returns the [filename, size] pairs removed, so
+# every file is handed out for deletion to one caller only.
+EVICT_SCRIPT = """
+local to_free = tonumber(ARGV[1])
+local freed = 0
+local removed = {}
+while freed < to_free do
+    local oldest = redis.call("ZRANGE", KEYS[2], 0, 0)
+    if #oldest == 0 then
+        break
+    end
+    local filename = oldest[1]
+    local size = tonumber(redis.call("HGET", KEYS[3], filename) or "0")
+    redis.call("ZREM", KEYS[1], filename)
+    redis.call("ZREM", KEYS[2], filename)
+    redis.call("HDEL", KEYS[3], filename)
+    redis.call("DECRBY", KEYS[4], size)
+    freed = freed + size
+    table.insert(removed, filename)
+    table.insert(removed, size)
+end
+return removed
+"""
+
+# Atomically takes a batch of due entries, so concurrent cleaners never
+# get the same file twice.
+POP_DUE_SCRIPT = """
+local due = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1], "LIMIT", 0, ARGV[2])
+for _, filename in ipairs(due) do
+    local size = redis.call("HGET", KEYS[3], filename)
+    if size then
+        redis.call("HDEL", KEYS[3], filename)
+        redis.call("DECRBY", KEYS[4], size)
+    end
+    redis.call("ZREM", KEYS[1], filename)
+    redis.call("ZREM", KEYS[2], filename)
+end
+return due
+"""
+
+_INDEX_KEYS = (VIDEO_EXPIRY_KEY, VIDEO_ACCESS_KEY, VIDEO_SIZE_KEY, VIDEO_BYTES_KEY)
+
+# How often a download waiting for disk space checks again
+_ADMISSION_POLL_SECONDS = 5.0
+
+
+class InsufficientStorageError(Exception):
+    """Raised when no space can be made for a new download."""
+
+
+async def register_video(
+    redis: Redis,
+    filename: str,
+    expires_at: float,
+    size: int,
+) -> None:
+    """
+    Add a stored video to the index.
+
+    :param redis: redis client.
+    :param filename: basename in download_dir.
+    :param expires_at: unix time after which the file may be deleted.
+    :param size: file size in bytes.
+    """
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zadd(VIDEO_EXPIRY_KEY, {filename: expires_at})
+        pipe.zadd(VIDEO_ACCESS_KEY, {filename: time.time()})
+        pipe.hset(VIDEO_SIZE_KEY, filename, size)
+        pipe.incrby(VIDEO_BYTES_KEY, size)
+        await pipe.execute()
+
+
+async def touch_video(redis: Redis, filename: str) -> None:
+    """
+    Mark a video as just served, moving it to the end of the eviction order.
+
+    :param redis: redis client.
+    :param filename: basename in download_dir.
+    """
+    await redis.zadd(VIDEO_ACCESS_KEY, {filename: time.time()}, xx=True)
+
+
+async def pop_expired_videos(redis: Redis, now: float, batch_size: int) -> list[str]:
+    """
+    Take videos whose expiry has passed out of the index.
+
+    :param redis: redis client.
+    :param now: current unix time.
+    :param batch_size: maximum number of entries to take.
+    :return: filenames to delete.
+    """
+    due = await redis.eval(
+        POP_DUE_SCRIPT, len(_INDEX_KEYS), *_INDEX_KEYS, now, batch_size
+    )
+    return [filename.decode() for filename in due]
+
+
+async def index_totals(redis: Redis) -> tuple[int, int]:
+    """
+    Count the indexed videos.
+
+    :param redis: redis client.
+    :return: number of videos and their total size in bytes.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hlen(VIDEO_SIZE_KEY)
+        pipe.get(VIDEO_BYTES_KEY)
+        files, size = await pipe.execute()
+    return files, int(size or 0)
+
+
+async def indexed_videos(redis: Redis, filenames: list[str]) -> set[str]:
+    """
+    Find which of the given files are in the index.
+
+    :param redis: redis client.
+    :param filenames: basenames in download_dir.
+    :return: the indexed ones.
+    """
+    scores = await redis.zmscore(VIDEO_EXPIRY_KEY, filenames)
+    return {
+        filename
+        for filename, score in zip(filenames, scores, strict=True)
+        if score is not None
+    }
+
+
+def delete_video_files(filenames: list[str]) -> int:
+    """
+    Delete videos from download_dir. Blocking.
+
+    :param filenames: basenames in download_dir.
+    :return: number of files that existed.
+    """
+    removed = 0
+    for filename in filenames:
+        try:
+            (settings.download_dir / filename).unlink()
+        except FileNotFoundError:
+            continue
+        removed += 1
+    return removed
+
+
+def _bytes_to_free(used: int, needed: int) -> int:
+    """How much must be evicted so ``needed`` more bytes fit the budget. Blocking."""
+    over_budget = 0
+    if settings.download_max_bytes:
+        over_budget = used + needed - settings.download_max_bytes
+    short_of_free = 0
+    if settings.download_min_free_bytes:
+        free = shutil.disk_usage(settings.download_dir).free
+        short_of_free = settings.download_min_free_bytes + needed - free
+    return max(over_budget, short_of_free)
+
+
+async def ensure_capacity(redis: Redis, needed: int) -> bool:
+    """
+    Evict least recently served videos until ``needed`` bytes fit.
+
+    The budget is ``download_max_bytes`` of indexed videos and/or
+    ``download_min_free_bytes`` left on the volume.
+
+    :param redis: redis client.
+    :param needed: bytes the caller is about to write.
+    :return: whether the space is available now.
+    """
+    used = int(await redis.get(VIDEO_BYTES_KEY) or 0)
+    to_free = await asyncio.to_thread(_bytes_to_free, used, needed)
+    if to_free <= 0:
+        return True
+    if to_free > used:
+        # Even evicting everything wouldn't help, keep the files
+        return False
+
+    removed = await redis.eval(EVICT_SCRIPT, len(_INDEX_KEYS), *_INDEX_KEYS, to_free)
+    filenames = [filename.decode() for filename in removed[::2]]
+    if filenames:
+        await asyncio.to_thread(delete_video_files, filenames)
+        logger.info(f"Evicted {len(filenames)} video(s) to free disk space")
+    return sum(int(size) for size in removed[1::2]) >= to_free
+
+
+async def wait_for_capacity(redis: Redis, needed: int) -> None:
+    """
+    Block a new download until there is room for it.
+
+    :param redis: redis client.
+    :param needed: bytes the download is expected to write.
+    :raises InsufficientStorageError: if no room was made in time.
+    """
+    deadline = time.monotonic() + settings.download_admission_timeout_seconds
+    while not await ensure_capacity(redis, needed):
+        if time.monotonic() >= deadline:
+            raise InsufficientStorageError(f"No room for {needed} more bytes")
+        logger.warning("Download directory is full, waiting for space")
+        await asyncio.sleep(_ADMISSION_POLL_SECONDS)
@@ -0,0 +1 @@
+"""Streaming pass-through service."""
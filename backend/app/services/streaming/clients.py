@@ -0,0 +1,44 @@
+import httpx
+
+from app.settings import settings
+
+
+class StreamClients:
+    """
+    Pooled HTTP clients for streaming media, one per proxy.
+
+    Media URLs are often bound to the address that extracted them, so the
+    bytes have to be fetched through the same proxy as the extraction.
+    """
+
+    def __init__(self, proxies: list[str]) -> None:
+        self._clients: dict[str | None, httpx.AsyncClient] = {
+            proxy: self._create_client(proxy) for proxy in {None, *proxies}
+        }
+
+    @staticmethod
+    def _create_client(proxy: str | None) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            proxy=proxy,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=settings.stream_max_connections,
+                max_keepalive_connections=settings.stream_max_connections,
+            ),
+            timeout=httpx.Timeout(
+                settings.stream_read_timeout_seconds,
+                connect=settings.stream_connect_timeout_seconds,
+            ),
+        )
+
+    def get(self, proxy: str | None) -> httpx.AsyncClient:
+        """Return the client for a proxy, or the direct one for None."""
+        if proxy not in self._clients:
+            self._clients[proxy] = self._create_client(proxy)
+        return self._clients[proxy]
+
+    async def close(self) -> None:
+        """Close all clients and their connections."""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
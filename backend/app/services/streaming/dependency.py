@@ -0,0 +1,24 @@
+from starlette.requests import Request
+
+from app.services.streaming.clients import StreamClients
+from app.services.streaming.links import StreamLinks
+
+
+def get_stream_clients(request: Request) -> StreamClients:  # pragma: no cover
+    """
+    Returns the streaming HTTP clients.
+
+    :param request: current request.
+    :returns: stream clients.
+    """
+    return request.app.state.stream_clients
+
+
+def get_stream_links(request: Request) -> StreamLinks:  # pragma: no cover
+    """
+    Returns the links resolved for /stream.
+
+    :param request: current request.
+    :returns: stream links.
+    """
+    return request.app.state.stream_links
@@ -0,0 +1,26 @@
+from fastapi import FastAPI
+
+from app.services.streaming.clients import StreamClients
+from app.services.streaming.links import StreamLinks
+from app.settings import settings
+
+
+def init_streaming(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Creates the HTTP clients used to stream media and the link cache.
+
+    :param app: current fastapi application.
+    """
+    app.state.stream_clients = StreamClients(
+        list(settings.cookie_proxy_map.values()),
+    )
+    app.state.stream_links = StreamLinks()
+
+
+async def shutdown_streaming(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Closes the streaming HTTP clients.
+
+    :param app: current FastAPI app.
+    """
+    await app.state.stream_clients.close()
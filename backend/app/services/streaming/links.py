@@ -0,0 +1,56 @@
+import time
+from collections import OrderedDict
+
+from app.services.redis.link_cache import link_cache_ttl
+from app.settings import settings
+
+
+class StreamLinks:
+    """
+    Links resolved for /stream in this process, by video and resolution.
+
+    Players send a new request for every seek. Within the lifetime of its
+    signed URLs, the link of a stream is answered from here, without a
+    Redis round trip or an extraction.
+    """
+
+    def __init__(self, size: int = settings.stream_link_cache_size) -> None:
+        self._size = size
+        # (video key, res) -> (monotonic time it expires, link info)
+        self._links: OrderedDict[tuple[str, int | None], tuple[float, dict]] = (
+            OrderedDict()
+        )
+
+    def get(self, key: str, res: int | None) -> dict | None:
+        """
+        Return the link resolved for a stream, if it is still valid.
+
+        :param key: video identity from ``video_key``.
+        :param res: requested height.
+        :return: link info or None.
+        """
+        entry = self._links.get((key, res))
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= time.monotonic():
+            del self._links[(key, res)]
+            return None
+        self._links.move_to_end((key, res))
+        return data
+
+    def put(self, key: str, res: int | None, data: dict) -> None:
+        """
+        Remember the link of a stream until its URLs are about to expire.
+
+        :param key: video identity from ``video_key``.
+        :param res: requested height.
+        :param data: link info from the extraction.
+        """
+        ttl = link_cache_ttl(data)
+        if ttl <= 0 or self._size <= 0:
+            return
+        self._links[(key, res)] = (time.monotonic() + ttl, data)
+        self._links.move_to_end((key, res))
+        while len(self._links) > self._size:
+            self._links.popitem(last=False)
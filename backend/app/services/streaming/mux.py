@@ -0,0 +1,215 @@
+import asyncio
+import os
+from collections.abc import AsyncGenerator
+
+import httpx
+from loguru import logger
+
+# Fragmented MP4 can be written to a pipe: no seeking back to write the moov
+FFMPEG_MUX_ARGS = (
+    "-hide_banner",
+    "-loglevel",
+    "error",
+    "-i",
+    "pipe:{video}",
+    "-i",
+    "pipe:{audio}",
+    "-map",
+    "0:v:0",
+    "-map",
+    "1:a:0",
+    "-c",
+    "copy",
+    "-movflags",
+    "frag_keyframe+empty_moov+default_base_moof",
+    "-f",
+    "mp4",
+    "pipe:1",
+)
+
+
+class MuxError(Exception):
+    """ffmpeg could not be started or failed while muxing."""
+
+
+class _PipeProtocol(asyncio.Protocol):
+    """Flow control for a pipe written from the event loop."""
+
+    def __init__(self) -> None:
+        self.can_write = asyncio.Event()
+        self.can_write.set()
+        self.closed = False
+
+    def pause_writing(self) -> None:
+        self.can_write.clear()
+
+    def resume_writing(self) -> None:
+        self.can_write.set()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.closed = True
+        self.can_write.set()
+
+
+class TrackMuxer:
+    """
+    Muxes a video-only and an audio-only track into MP4 on the fly.
+
+    Both tracks are fetched concurrently and fed to ffmpeg through pipes,
+    its output is read in chunks as the client consumes them. Nothing is
+    written to disk.
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        video: dict,
+        audio: dict,
+        chunk_size: int,
+    ) -> None:
+        self._client = client
+        self._tracks = (video, audio)
+        self._chunk_size = chunk_size
+        self._responses: list[httpx.Response] = []
+        self._process: asyncio.subprocess.Process | None = None
+        self._pipes: list[asyncio.WriteTransport] = []
+        self._tasks: list[asyncio.Task] = []
+        # Error that cut a track short, the output is incomplete then
+        self._track_error: httpx.HTTPError | None = None
+
+    async def start(self) -> None:
+        """
+        Open both tracks and start ffmpeg.
+
+        :raises httpx.HTTPError: if a track can't be fetched.
+        :raises MuxError: if ffmpeg can't be started.
+        """
+        try:
+            results = await asyncio.gather(
+                *(self._open(track) for track in self._tracks),
+                return_exceptions=True,
+            )
+            self._responses = [
+                result for result in results if isinstance(result, httpx.Response)
+            ]
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+                result.raise_for_status()
+
+            video_read, video_write = os.pipe()
+            audio_read, audio_write = os.pipe()
+            # Write ends not handed over to a pipe transport yet
+            write_fds = [video_write, audio_write]
+            try:
+                try:
+                    args = [
+                        arg.format(video=video_read, audio=audio_read)
+                        for arg in FFMPEG_MUX_ARGS
+                    ]
+                    self._process = await asyncio.create_subprocess_exec(
+                        "ffmpeg",
+                        *args,
+                        stdin=asyncio.subprocess.DEVNULL,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.PIPE,
+                        pass_fds=(video_read, audio_read),
+                    )
+                except OSError as exc:
+                    raise MuxError(f"Failed to start ffmpeg: {exc}") from exc
+                finally:
+                    # ffmpeg holds its own copies of the read ends
+                    os.close(video_read)
+                    os.close(audio_read)
+
+                loop = asyncio.get_running_loop()
+                for response, fd in zip(
+                    self._responses,
+                    (video_write, audio_write),
+                    strict=True,
+                ):
+                    pipe = os.fdopen(fd, "wb", buffering=0)
+                    write_fds.remove(fd)
+                    transport, protocol = await loop.connect_write_pipe(
+                        _PipeProtocol, pipe
+                    )
+                    self._pipes.append(transport)
+                    self._tasks.append(
+                        asyncio.create_task(self._feed(response, transport, protocol)),
+                    )
+            finally:
+                for fd in write_fds:
+                    os.close(fd)
+            self._tasks.append(asyncio.create_task(self._process.stderr.read()))
+        except BaseException:
+            await self.close()
+            raise
+
+    async def _open(self, track: dict) -> httpx.Response:
+        return await self._client.send(
+            self._client.build_request(
+                "GET",
+                track["url"],
+                headers=track.get("http_headers") or {},
+            ),
+            stream=True,
+        )
+
+    async def _feed(
+        self,
+        response: httpx.Response,
+        transport: asyncio.WriteTransport,
+        protocol: _PipeProtocol,
+    ) -> None:
+        """Copy a track into ffmpeg, no faster than ffmpeg reads it."""
+        try:
+            async for chunk in response.aiter_raw(self._chunk_size):
+                await protocol.can_write.wait()
+                if protocol.closed:
+                    # ffmpeg stopped reading, e.g. it failed
+                    return
+                transport.write(chunk)
+        except httpx.HTTPError as exc:
+            logger.error(f"Track download failed while muxing: {exc}")
+            self._track_error = exc
+            # Closing the pipe would pass the cut track off as complete
+            if self._process.returncode is None:
+                self._process.kill()
+        finally:
+            # EOF tells ffmpeg the track is complete
+            transport.close()
+
+    async def chunks(self) -> AsyncGenerator[bytes, None]:
+        """Yield the muxed MP4 as ffmpeg produces it, then clean up."""
+        if self._process is None:
+            raise RuntimeError("TrackMuxer.start() was not called")
+        try:
+            while chunk := await self._process.stdout.read(self._chunk_size):
+                yield chunk
+            returncode = await self._process.wait()
+            if self._track_error is not None:
+                # Headers are already sent, failing aborts the response
+                raise MuxError(f"Track download failed: {self._track_error}")
+            if returncode:
+                stderr = await self._tasks[-1]
+                # Headers are already sent, the client sees a truncated file
+                logger.error(
+                    f"ffmpeg mux failed ({returncode}): "
+                    f"{stderr.decode(errors='replace').strip()}"
+                )
+                raise MuxError(f"ffmpeg exited with {returncode}")
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        """Stop ffmpeg and the track downloads."""
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for pipe in self._pipes:
+            pipe.close()
+        for response in self._responses:
+            await response.aclose()
@@ -0,0 +1 @@
+"""yt-dlp service."""
@@ -0,0 +1,75 @@
+import re
+from functools import lru_cache
+from typing import Any
+
+import yt_dlp
+from loguru import logger
+
+from app.settings import settings
+
+# Errors that mean the site or the proxy turned the account away, as
+# opposed to problems with the video itself
+_BLOCKED_PATTERN = re.compile(
+    r"HTTP Error (?:403|429)"
+    r"|Sign in to confirm you(?:'|’)re not a bot"
+    r"|rate.?limit",
+    re.IGNORECASE,
+)
+_PROXY_PATTERN = re.compile(
+    r"ProxyError|proxy|SOCKS|Tunnel connection failed",
+    re.IGNORECASE,
+)
+
+
+@lru_cache(maxsize=1)
+def configured_accounts() -> tuple[str, ...]:
+    """Cookie files from ``cookie_proxy_map``, each one account."""
+    return tuple(settings.cookie_proxy_map)
+
+
+def account_options(account: str) -> dict[str, Any]:
+    """
+    yt-dlp options that make requests as the given account.
+
+    :param account: cookie filename from ``cookie_proxy_map``.
+    :return: cookiefile and proxy options.
+    """
+    ydl_opts: dict[str, Any] = {}
+    cookie_path = settings.cookies_dir / account
+    if cookie_path.exists():
+        ydl_opts["cookiefile"] = str(cookie_path)
+        logger.info(f"Using cookie file: {account}")
+    else:
+        logger.warning(f"Cookie file not found: {cookie_path}")
+
+    proxy = settings.cookie_proxy_map.get(account)
+    if proxy:
+        ydl_opts["proxy"] = proxy
+        logger.info(f"Using proxy for {account}: {proxy}")
+    return ydl_opts
+
+
+def is_account_error(exc: BaseException) -> bool:
+    """
+    Check whether a failure is the account's fault.
+
+    Blocks (403, 429, bot checks) and proxy failures count against the
+    account, errors about the video itself don't.
+    """
+    message = str(exc)
+    return bool(_BLOCKED_PATTERN.search(message) or _PROXY_PATTERN.search(message))
+
+
+def probe_account(account: str) -> None:
+    """
+    Extract ``account_probe_url`` as the account. Blocking.
+
+    :raises yt_dlp.utils.DownloadError: if the account still can't extract.
+    """
+    ydl_opts = {
+        "quiet": True,
+        "socket_timeout": settings.extraction_timeout_seconds,
+        **account_options(account),
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.extract_info(settings.account_probe_url, download=False)
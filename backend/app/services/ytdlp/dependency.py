@@ -0,0 +1,13 @@
+from starlette.requests import Request
+
+from app.services.ytdlp.executor import ExtractionExecutor
+
+
+def get_extraction_executor(request: Request) -> ExtractionExecutor:  # pragma: no cover
+    """
+    Returns the yt-dlp extraction pool.
+
+    :param request: current request.
+    :returns: extraction executor.
+    """
+    return request.app.state.extraction_executor
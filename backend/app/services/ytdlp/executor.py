@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+class ExtractionQueueFullError(Exception):
+    """Raised when the extraction pool can't accept more work."""
+
+
+class ExtractionExecutor:
+    """
+    Bounded thread pool for blocking yt-dlp calls.
+
+    yt-dlp is fully synchronous, so running it inside a request handler
+    freezes the whole uvicorn worker. This executor moves the work to a
+    dedicated pool with a fixed number of threads and a bounded backlog:
+    once `workers + queue_size` jobs are pending, new jobs are rejected
+    immediately instead of piling up behind slow extractions.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float) -> None:
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="ytdlp-extract",
+        )
+        # A slot is held from submission until the thread finishes, so
+        # timed out jobs that are still running keep counting against
+        # the limit.
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking function in the pool.
+
+        :param func: function to call.
+        :param args: positional arguments for the function.
+        :raises ExtractionQueueFullError: if the backlog is full.
+        :raises TimeoutError: if the job didn't finish in time.
+        :return: function result.
+        """
+        if not self._slots.acquire(blocking=False):
+            raise ExtractionQueueFullError
+        try:
+            future = self._pool.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        # On timeout the wrapped future is cancelled, which drops the job
+        # if it hasn't started yet. A running thread can't be interrupted,
+        # it just finishes in the background.
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs and drop the ones that haven't started."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,108 @@
+from typing import Any
+
+from app.settings import settings
+
+# Codecs that go into MP4 as they are (yt-dlp's names, version suffix
+# stripped), so merging or changing the container is a stream copy
+MP4_VIDEO_CODECS = {"avc1", "avc3", "h264", "hvc1", "hev1", "hevc", "av01", "av1"}
+MP4_AUDIO_CODECS = {"mp4a", "aac", "mp3", "ac-3", "ec-3"}
+MP4_EXTENSIONS = {"mp4", "m4a", "m4v", "mov"}
+
+# Merge into MP4 when the codecs allow it, MKV (anything goes) otherwise
+MERGE_OUTPUT_FORMAT = "mp4/mkv"
+
+
+def download_format_sort(res: str) -> list[str]:
+    """
+    yt-dlp ``format_sort`` for downloads.
+
+    The resolution closest to ``res`` wins, then MP4 video and M4A audio
+    (H.264, HEVC, AV1 and AAC on the sites we support) over WebM.
+    """
+    return [f"res:{res}", "ext:mp4:m4a"]
+
+
+def _codec(value: str | None) -> str | None:
+    if value in (None, "none"):
+        return None
+    return value.split(".")[0].lower()
+
+
+def is_mp4_compatible(info: dict[str, Any]) -> bool:
+    """
+    Check whether the selected formats can be copied into MP4.
+
+    :param info: yt-dlp info dict after format selection.
+    :return: False if the video would have to be re-encoded.
+    """
+    formats = info.get("requested_formats") or [info]
+    for fmt in formats:
+        vcodec, acodec = _codec(fmt.get("vcodec")), _codec(fmt.get("acodec"))
+        if vcodec is None and acodec is None:
+            # Codecs not reported by the site, go by the container
+            if fmt.get("ext") not in MP4_EXTENSIONS:
+                return False
+            continue
+        if vcodec is not None and vcodec not in MP4_VIDEO_CODECS:
+            return False
+        if acodec is not None and acodec not in MP4_AUDIO_CODECS:
+            return False
+    return True
+
+
+def estimate_download_bytes(link: dict[str, Any], res: str) -> int | None:
+    """
+    Estimate the size of a download from its link info.
+
+    :param link: response of /get_download_link.
+    :param res: requested height, anything else means the best one.
+    :return: video and audio size in bytes, None if the site doesn't say.
+    """
+    height = int(res) if res.isdigit() else None
+    audio_size = (link.get("audio") or {}).get("filesize") or 0
+    # (height, size) of what yt-dlp may pick: a video-only format merged
+    # with the audio track, or the muxed one
+    choices = [
+        (fmt["height"], fmt.get("filesize") and fmt["filesize"] + audio_size)
+        for fmt in link.get("resolutions", [])
+        if fmt.get("height")
+    ]
+    if link.get("main_resolution"):
+        choices.append((link["main_resolution"], link.get("filesize")))
+    if not choices:
+        return None
+    # The best height not above res, the closest one if all are above
+    fitting = [choice for choice in choices if height is None or choice[0] <= height]
+    if fitting:
+        return max(fitting, key=lambda choice: choice[0])[1]
+    return min(choices, key=lambda choice: choice[0])[1]
+
+
+def _is_heavy(size: int | None, duration: float | None) -> bool:
+    if size is None and duration is None:
+        return True
+    return (size or 0) >= settings.heavy_download_min_bytes or (
+        duration or 0
+    ) >= settings.heavy_download_min_seconds
+
+
+def is_heavy_download(link: dict[str, Any], res: str) -> bool:
+    """
+    Check whether a download belongs on the heavy worker queues.
+
+    Long or large videos are heavy, and so are videos with neither a
+    known duration nor a known size (live streams, odd sites).
+    """
+    return _is_heavy(estimate_download_bytes(link, res), link.get("duration"))
+
+
+def is_heavy_selection(info: dict[str, Any]) -> bool:
+    """
+    Like ``is_heavy_download``, for the formats yt-dlp selected.
+
+    :param info: yt-dlp info dict after format selection.
+    """
+    formats = info.get("requested_formats") or [info]
+    sizes = [fmt.get("filesize") or fmt.get("filesize_approx") for fmt in formats]
+    size = sum(sizes) if all(sizes) else None
+    return _is_heavy(size, info.get("duration"))
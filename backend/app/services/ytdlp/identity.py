@@ -0,0 +1,71 @@
+import hashlib
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from yt_dlp.extractor import gen_extractor_classes
+
+# Query parameters that never change which video a URL points to
+_TRACKING_PARAMS = {"fbclid", "gclid", "igsh", "igshid", "si", "feature", "t"}
+
+
+@lru_cache(maxsize=1)
+def _extractors() -> list:
+    return [ie for ie in gen_extractor_classes() if ie.ie_key() != "Generic"]
+
+
+def _normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name not in _TRACKING_PARAMS and not name.startswith("utm_")
+    )
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower().removeprefix("www."),
+            parts.path.rstrip("/"),
+            urlencode(query),
+            "",
+        )
+    )
+
+
+@lru_cache(maxsize=4096)
+def video_key(url: str) -> str:
+    """
+    Stable identity of the video behind a URL.
+
+    Uses yt-dlp's own URL matching, so ``youtu.be/ID``, ``youtube.com/watch?v=ID``
+    and ``youtube.com/shorts/ID`` all map to ``Youtube:ID`` without any network
+    calls. URLs no extractor recognizes fall back to a hash of the normalized URL.
+
+    :param url: video page URL.
+    :return: key like ``Youtube:dQw4w9WgXcQ``.
+    """
+    for ie in _extractors():
+        if not ie.suitable(url):
+            continue
+        video_id = ie.get_temp_id(url)
+        if video_id:
+            return f"{ie.ie_key()}:{video_id}"
+        break
+
+    digest = hashlib.sha1(_normalize_url(url).encode()).hexdigest()  # noqa: S324
+    return f"url:{digest}"
+
+
+@lru_cache(maxsize=4096)
+def site_key(url: str) -> str:
+    """
+    Site a URL belongs to, for per-site limits.
+
+    :param url: video page URL.
+    :return: lowercase yt-dlp extractor key like ``youtube``, or the host
+        name for URLs no extractor recognizes.
+    """
+    for ie in _extractors():
+        if ie.suitable(url):
+            return ie.ie_key().lower()
+    host = urlsplit(url.strip()).hostname or "unknown"
+    return host.removeprefix("www.")
@@ -0,0 +1,26 @@
+from fastapi import FastAPI
+
+from app.services.ytdlp.executor import ExtractionExecutor
+from app.settings import settings
+
+
+def init_extraction(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Creates the yt-dlp extraction pool.
+
+    :param app: current fastapi application.
+    """
+    app.state.extraction_executor = ExtractionExecutor(
+        workers=settings.extraction_workers,
+        queue_size=settings.extraction_queue_size,
+        timeout=settings.extraction_timeout_seconds,
+    )
+
+
+def shutdown_extraction(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Shuts down the yt-dlp extraction pool.
+
+    :param app: current FastAPI app.
+    """
+    app.state.extraction_executor.shutdown()
@@ -0,0 +1,36 @@
+from typing import Any
+
+from app.settings import settings
+
+# Pause before yt-dlp retries a failed request or fragment, doubling with
+# every retry up to the max
+_RETRY_SLEEP_SECONDS = 1.0
+_RETRY_SLEEP_MAX_SECONDS = 30.0
+
+
+def retry_sleep(n: int) -> float:
+    """Seconds to wait before retry ``n`` (from 0) of a request."""
+    return min(_RETRY_SLEEP_SECONDS * 2**n, _RETRY_SLEEP_MAX_SECONDS)
+
+
+def transfer_options(site: str, backoff_level: int = 0) -> dict[str, Any]:
+    """
+    yt-dlp options for how a download's bytes are fetched.
+
+    :param site: site key from ``site_key``.
+    :param backoff_level: from ``backoff_level``, every level halves the
+        parallel fragment downloads.
+    :return: fragment concurrency, chunk size and retry options.
+    """
+    fragments = settings.site_fragment_concurrency.get(
+        site,
+        settings.download_fragment_concurrency,
+    )
+    chunk_bytes = settings.site_chunk_bytes.get(site, settings.download_chunk_bytes)
+    options: dict[str, Any] = {
+        "concurrent_fragment_downloads": max(1, fragments >> backoff_level),
+        "retry_sleep_functions": {"http": retry_sleep, "fragment": retry_sleep},
+    }
+    if chunk_bytes > 0:
+        options["http_chunk_size"] = chunk_bytes
+    return options
@@ -1,9 +1,20 @@
+from .account_tasks import probe_accounts
 from .broker import broker
-from .cleanup_tasks import cleanup_old_videos
-from .download_tasks import download_video
+from .cleanup_tasks import (
+    cleanup_expired_videos,
+    cleanup_old_videos,
+    cleanup_partial_downloads,
+)
+from .download_tasks import download_video, transcode_video
+from .notification_tasks import deliver_notifications
 
 __all__ = [
     "broker",
+    "cleanup_expired_videos",
     "cleanup_old_videos",
+    "cleanup_partial_downloads",
+    "deliver_notifications",
     "download_video",
+    "probe_accounts",
+    "transcode_video",
 ]
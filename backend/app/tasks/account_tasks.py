@@ -0,0 +1,48 @@
+import asyncio
+
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis
+from taskiq import TaskiqDepends
+
+from app.services.metrics import metrics
+from app.services.redis.account_pool import accounts_to_probe, finish_probe
+from app.services.ytdlp.accounts import probe_account
+from app.settings import settings
+from app.tasks.broker import broker
+from app.tasks.dependencies import get_redis_pool
+from app.tasks.queues import MAINTENANCE_QUEUE
+
+
+async def _probe(redis: Redis, account: str) -> bool:
+    try:
+        await asyncio.wait_for(
+            asyncio.to_thread(probe_account, account),
+            settings.extraction_timeout_seconds,
+        )
+    except Exception as exc:
+        logger.warning(f"Account {account} failed its probe: {exc}")
+        passed = False
+    else:
+        logger.info(f"Account {account} passed its probe, back in rotation")
+        passed = True
+    await finish_probe(redis, account, passed)
+    metrics.inc("account_probes_total", result="passed" if passed else "failed")
+    return passed
+
+
+@broker.task(schedule=[{"cron": "* * * * *"}], queue_name=MAINTENANCE_QUEUE)
+async def probe_accounts(
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+) -> int:
+    """
+    Probe tripped accounts whose rest period is over.
+
+    Accounts that extract a known video again go back into rotation, the
+    others rest for longer. Returns the number of recovered accounts.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        accounts = await accounts_to_probe(redis)
+        results = await asyncio.gather(
+            *(_probe(redis, account) for account in accounts)
+        )
+    return sum(results)
@@ -1,16 +1,203 @@
-from taskiq import TaskiqScheduler, TaskiqState
+import asyncio
+import multiprocessing
+import time
+from collections.abc import AsyncGenerator
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from typing import Any
+
+import httpx
+from loguru import logger
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import RedisError
+from taskiq import AckableMessage, TaskiqEvents, TaskiqScheduler, TaskiqState
+from taskiq.schedule_sources import LabelScheduleSource
 from taskiq_redis import (
+    RedisAsyncResultBackend,
     RedisScheduleSource,
     RedisStreamBroker,
 )
 
+from app.services.metrics.flusher import start_metrics_flusher, stop_metrics_flusher
 from app.settings import settings
+from app.tasks.queues import DEFAULT_QUEUE, QUEUES
+
+# How often a worker takes over tasks of workers that died mid-task
+_CLAIM_INTERVAL_SECONDS = 30.0
+
+
+class WeightedStreamBroker(RedisStreamBroker):
+    """
+    Stream broker that shares a worker between streams by weight.
+
+    The stock broker reads all streams in one XREADGROUP, so a busy stream
+    can fill the worker before the others get a turn. Here every round
+    takes up to ``weight`` new tasks from each stream, heaviest first,
+    and blocks on all of them only when every stream is empty.
+
+    Tasks stay pending in their stream until acked, and pending ones idle
+    longer than ``idle_timeout`` are taken over by other workers. Downloads
+    run (or wait for slots) far longer than that, so the broker keeps
+    resetting the idle time of every task it still holds. Only tasks of a
+    worker that died go idle.
+    """
+
+    def __init__(self, url: str, queue_weights: dict[str, int], **kwargs: Any) -> None:
+        """
+        Constructs a broker that reads the streams in ``queue_weights``.
+
+        :param url: url to redis.
+        :param queue_weights: stream -> new tasks taken from it per round.
+            Streams with a weight below 1 aren't read.
+        """
+        streams = [*QUEUES, *queue_weights]
+        super().__init__(
+            url,
+            queue_name=DEFAULT_QUEUE,
+            # Consumer groups are declared and queue metrics reported for
+            # every stream, even the ones this worker doesn't read
+            additional_streams={
+                stream: ">"
+                for stream in dict.fromkeys(streams)
+                if stream != DEFAULT_QUEUE
+            },
+            **kwargs,
+        )
+        self.queue_weights = {
+            stream: weight
+            for stream, weight in sorted(
+                queue_weights.items(), key=lambda item: -item[1]
+            )
+            if weight > 0
+        }
+        # Stream -> ids of the tasks taken but not acked yet
+        self._held: dict[str, set[bytes]] = {}
+        self._heartbeat: asyncio.Task | None = None
+
+    def _ackable(self, stream: str, msg_id: bytes, data: bytes) -> AckableMessage:
+        held = self._held.setdefault(stream, set())
+        held.add(msg_id)
+        ack = self._ack_generator(id=msg_id, queue_name=stream)
+
+        async def ack_and_release() -> None:
+            await ack()
+            held.discard(msg_id)
+
+        return AckableMessage(data=data, ack=ack_and_release)
+
+    def _messages(self, fetched: Any) -> list[AckableMessage]:
+        return [
+            self._ackable(stream, msg_id, msg[b"data"])
+            for stream, msg_list in fetched or []
+            for msg_id, msg in msg_list
+            # Entries deleted while pending come back without data
+            if msg
+        ]
+
+    async def _keep_held(self) -> None:
+        """Reset the idle time of held tasks, so nobody takes them over."""
+        async with Redis(connection_pool=self.connection_pool) as redis_conn:
+            while True:
+                await asyncio.sleep(self.idle_timeout / 1000 / 4)
+                for stream, held in list(self._held.items()):
+                    if not held:
+                        continue
+                    ids = list(held)
+                    try:
+                        # JUSTID claims without delivering, it only resets
+                        # the idle time (and keeps the delivery count)
+                        claimed = await redis_conn.xclaim(
+                            stream,
+                            self.consumer_group_name,
+                            self.consumer_name,
+                            min_idle_time=0,
+                            message_ids=ids,
+                            justid=True,
+                        )
+                    except RedisError as exc:
+                        logger.warning(
+                            f"Failed to refresh tasks held from {stream}: {exc}"
+                        )
+                        continue
+                    # Not pending anymore (acked elsewhere, or trimmed)
+                    held.difference_update(set(ids) - set(claimed))
+
+    async def _claim_abandoned(self, redis_conn: Redis) -> list[AckableMessage]:
+        """Tasks left unacked longer than ``idle_timeout`` by dead workers."""
+        messages = []
+        for stream in self.queue_weights:
+            async with redis_conn.lock(
+                f"autoclaim:{self.consumer_group_name}:{stream}",
+                timeout=self.unacknowledged_lock_timeout,
+            ):
+                _, claimed, *_ = await redis_conn.xautoclaim(
+                    name=stream,
+                    groupname=self.consumer_group_name,
+                    consumername=self.consumer_name,
+                    min_idle_time=self.idle_timeout,
+                    count=self.unacknowledged_batch_size,
+                )
+            if claimed:
+                logger.info(f"Claimed {len(claimed)} abandoned tasks from {stream}")
+            messages += self._messages([(stream, claimed)])
+        return messages
+
+    async def listen(self) -> AsyncGenerator[AckableMessage, None]:
+        """Listen to the weighted streams."""
+        if not self.queue_weights:
+            raise ValueError("The worker has no task streams to read")
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._keep_held())
+        last_claim = 0.0
+        async with Redis(connection_pool=self.connection_pool) as redis_conn:
+            while True:
+                messages = []
+                for stream, weight in self.queue_weights.items():
+                    fetched = await redis_conn.xreadgroup(
+                        self.consumer_group_name,
+                        self.consumer_name,
+                        {stream: ">"},
+                        count=weight,
+                    )
+                    messages += self._messages(fetched)
+                if not messages:
+                    fetched = await redis_conn.xreadgroup(
+                        self.consumer_group_name,
+                        self.consumer_name,
+                        dict.fromkeys(self.queue_weights, ">"),
+                        block=self.block,
+                        count=1,
+                    )
+                    messages = self._messages(fetched)
+                if time.monotonic() - last_claim >= _CLAIM_INTERVAL_SECONDS:
+                    messages += await self._claim_abandoned(redis_conn)
+                    last_claim = time.monotonic()
+                for message in messages:
+                    yield message
+
+    async def shutdown(self) -> None:
+        """Stop refreshing held tasks and close the connection pool."""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._heartbeat
+            self._heartbeat = None
+        await super().shutdown()
+
 
 redis_source = RedisScheduleSource(str(settings.redis_url))
-broker = RedisStreamBroker(
+broker = WeightedStreamBroker(
     url=str(settings.redis_url),
+    queue_weights=settings.worker_queue_weights,
+).with_result_backend(
+    RedisAsyncResultBackend(
+        str(settings.redis_url),
+        result_ex_time=settings.task_status_seconds,
+        prefix_str="task:result",
+    ),
 )
-scheduler = TaskiqScheduler(broker, sources=[redis_source])
+# Label source picks up schedules declared in @broker.task(schedule=...)
+scheduler = TaskiqScheduler(broker, sources=[redis_source, LabelScheduleSource(broker)])
 
 
 @broker.on_event("startup")
@@ -20,4 +207,70 @@ async def setup_logging(_state: TaskiqState) -> None:
     configure_logging()
 
 
-__all__ = ["broker", "scheduler"]
+def create_download_pool() -> ProcessPoolExecutor:
+    """Process pool the worker's downloads run in."""
+    # yt-dlp downloads and ffmpeg merges block, so they run in child
+    # processes while the worker's event loop keeps serving other tasks.
+    # "spawn" avoids forking a process with a running event loop and
+    # open Redis connections.
+    return ProcessPoolExecutor(
+        max_workers=settings.download_processes,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def setup_download_pool(state: TaskiqState) -> None:
+    state.download_pool = create_download_pool()
+    # The worker takes more tasks than it has processes. Only as many
+    # downloads as there are processes hold cluster-wide accounts and
+    # slots at a time, the rest leave them to workers with idle processes
+    state.download_admission = asyncio.Semaphore(settings.download_processes)
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def shutdown_download_pool(state: TaskiqState) -> None:
+    # Waits for running downloads, off the event loop so other tasks can
+    # still finish meanwhile
+    await asyncio.to_thread(
+        state.download_pool.shutdown, wait=True, cancel_futures=True
+    )
+
+
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def setup_worker_clients(state: TaskiqState) -> None:
+    # Shared by all tasks of the worker, so they reuse connections instead
+    # of connecting (and for the bot, negotiating TLS) every time.
+    # Tasks get them with TaskiqDepends, see app.tasks.dependencies
+    state.redis_pool = BlockingConnectionPool.from_url(
+        str(settings.redis_url),
+        max_connections=settings.worker_redis_max_connections,
+    )
+    state.http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=settings.worker_http_max_connections,
+            max_keepalive_connections=settings.worker_http_max_connections,
+        ),
+    )
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def shutdown_worker_clients(state: TaskiqState) -> None:
+    await state.http_client.aclose()
+    await state.redis_pool.disconnect()
+
+
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def setup_metrics(state: TaskiqState) -> None:
+    state.metrics_redis = Redis.from_url(str(settings.redis_url))
+    state.metrics_flusher = start_metrics_flusher(state.metrics_redis)
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def shutdown_metrics(state: TaskiqState) -> None:
+    await stop_metrics_flusher(state.metrics_flusher, state.metrics_redis)
+    await state.metrics_redis.aclose()
+
+
+__all__ = ["broker", "create_download_pool", "scheduler"]
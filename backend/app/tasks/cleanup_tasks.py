@@ -1,30 +1,156 @@
+import asyncio
+import os
+import shutil
 import time
+from pathlib import Path
 
 from loguru import logger
+from redis.asyncio import ConnectionPool, Redis
+from taskiq import TaskiqDepends
 
+from app.services.redis.lease import acquire_lease, release_lease
+from app.services.redis.video_index import (
+    delete_video_files,
+    indexed_videos,
+    pop_expired_videos,
+)
 from app.settings import settings
 from app.tasks.broker import broker
+from app.tasks.dependencies import get_redis_pool
+from app.tasks.download_tasks import PARTIAL_DIR, work_dir_lease_key
+from app.tasks.queues import MAINTENANCE_QUEUE
 
+# Orphans are only removed well after regular expiry would have caught them
+RECONCILE_GRACE_SECONDS = 10 * 60
 
-@broker.task(schedule=[{"cron": "*/5 * * * *"}])
-def cleanup_old_videos() -> int:
-    """Delete downloaded videos older than video_storage_minutes. Returns count removed."""
-    max_age_seconds = settings.video_storage_minutes * 60
-    now = time.time()
+
+@broker.task(schedule=[{"cron": "* * * * *"}], queue_name=MAINTENANCE_QUEUE)
+async def cleanup_expired_videos(
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+) -> int:
+    """
+    Delete videos as soon as their entry in the expiry index is due.
+
+    Started every minute and polls the index every cleanup_poll_seconds
+    until the next run takes over, so files go away within seconds of
+    their TTL. Returns count removed.
+    """
+    deadline = time.monotonic() + 60 - settings.cleanup_poll_seconds
     removed = 0
 
+    async with Redis(connection_pool=redis_pool) as redis:
+        while True:
+            while due := await pop_expired_videos(
+                redis,
+                time.time(),
+                settings.cleanup_batch_size,
+            ):
+                count = await asyncio.to_thread(delete_video_files, due)
+                logger.info(f"Cleaned up {count} expired video(s)")
+                removed += count
+            if time.monotonic() >= deadline:
+                return removed
+            await asyncio.sleep(settings.cleanup_poll_seconds)
+
+
+def _old_files(max_age_seconds: float) -> list[str]:
+    """Files in download_dir not modified for ``max_age_seconds``. Blocking."""
     if not settings.download_dir.exists():
+        return []
+    now = time.time()
+    old = []
+    with os.scandir(settings.download_dir) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and now - entry.stat().st_mtime > max_age_seconds:
+                    old.append(entry.name)
+            except FileNotFoundError:
+                continue
+    return old
+
+
+@broker.task(schedule=[{"cron": "17 * * * *"}], queue_name=MAINTENANCE_QUEUE)
+async def cleanup_old_videos(
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+) -> int:
+    """
+    Delete videos missing from the expiry index. Returns count removed.
+
+    Full directory scan, so it only runs hourly to catch files the index
+    lost track of (e.g. a worker killed between download and indexing).
+    Only files older than a video's storage time are looked up, so ones
+    about to be indexed are left alone, and indexed files are kept however
+    old they are: their expiry may have been pushed back.
+    """
+    max_age_seconds = settings.video_storage_minutes * 60 + RECONCILE_GRACE_SECONDS
+    candidates = await asyncio.to_thread(_old_files, max_age_seconds)
+    if not candidates:
         return 0
 
-    for file in settings.download_dir.iterdir():
-        if not file.is_file():
-            continue
-        age = now - file.stat().st_mtime
-        if age > max_age_seconds:
-            file.unlink()
-            logger.info(f"Cleaned up old video: {file.name} (age={age:.0f}s)")
-            removed += 1
+    async with Redis(connection_pool=redis_pool) as redis:
+        indexed = await indexed_videos(redis, candidates)
+    orphans = [filename for filename in candidates if filename not in indexed]
+    removed = await asyncio.to_thread(delete_video_files, orphans)
 
     if removed:
-        logger.info(f"Cleanup complete: removed {removed} file(s)")
+        logger.info(f"Cleanup complete: removed {removed} unindexed video(s)")
+    return removed
+
+
+def _last_modified(directory: Path) -> float:
+    """Latest mtime of a directory and the files in it."""
+    mtimes = [directory.stat().st_mtime]
+    for file in directory.rglob("*"):
+        try:
+            mtimes.append(file.stat().st_mtime)
+        except FileNotFoundError:
+            continue
+    return max(mtimes)
+
+
+def _idle_partial_downloads() -> list[Path]:
+    """Partial download directories unchanged for too long. Blocking."""
+    if not PARTIAL_DIR.exists():
+        return []
+
+    now = time.time()
+    idle_dirs = []
+    for directory in PARTIAL_DIR.iterdir():
+        if not directory.is_dir():
+            continue
+        try:
+            idle = now - _last_modified(directory)
+        except FileNotFoundError:
+            # Finished in the meantime
+            continue
+        if idle > settings.partial_download_keep_seconds:
+            idle_dirs.append(directory)
+    return idle_dirs
+
+
+@broker.task(schedule=[{"cron": "*/10 * * * *"}], queue_name=MAINTENANCE_QUEUE)
+async def cleanup_partial_downloads(
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+) -> int:
+    """
+    Delete partial downloads nobody is going to resume. Returns count removed.
+
+    A download writes to its directory all the time, so one that hasn't
+    changed for partial_download_keep_seconds belongs to a task that died
+    and wasn't redelivered. The task's lease is taken first, so a copy that
+    is still running (e.g. waiting for a slot) keeps its files.
+    """
+    removed = 0
+    async with Redis(connection_pool=redis_pool) as redis:
+        for directory in await asyncio.to_thread(_idle_partial_downloads):
+            key = work_dir_lease_key(directory.name)
+            token = await acquire_lease(redis, key)
+            if token is None:
+                continue
+            try:
+                await asyncio.to_thread(shutil.rmtree, directory, ignore_errors=True)
+            finally:
+                await release_lease(redis, key, token)
+            logger.info(f"Cleaned up abandoned download: {directory.name}")
+            removed += 1
     return removed
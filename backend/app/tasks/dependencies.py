@@ -0,0 +1,30 @@
+import httpx
+from redis.asyncio import ConnectionPool
+from taskiq import Context, TaskiqDepends
+
+
+def get_redis_pool(context: Context = TaskiqDepends()) -> ConnectionPool:
+    """
+    Returns the worker's Redis connection pool.
+
+    You can use it like this:
+
+    >>> @broker.task
+    >>> async def task(redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool)):
+    >>>     async with Redis(connection_pool=redis_pool) as redis:
+    >>>         await redis.get('key')
+
+    :param context: current task context.
+    :returns: redis connection pool.
+    """
+    return context.state.redis_pool
+
+
+def get_http_client(context: Context = TaskiqDepends()) -> httpx.AsyncClient:
+    """
+    Returns the worker's HTTP client, connections to the bot are kept alive.
+
+    :param context: current task context.
+    :returns: http client.
+    """
+    return context.state.http_client
@@ -1,18 +1,423 @@
-import random
+import asyncio
+import shutil
+import time
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import AbstractAsyncContextManager, nullcontext
+from dataclasses import dataclass
 from pathlib import Path
-from uuid import uuid4
+from typing import Any
 
 import yt_dlp
 from loguru import logger
-from redis.asyncio import Redis
+from redis.asyncio import ConnectionPool, Redis
 from taskiq import Context, TaskiqDepends
+from yt_dlp.postprocessor import FFmpegVideoRemuxerPP
 
+from app.services.metrics import DURATION_BUCKETS, hashed_label, metrics
+from app.services.redis.account_pool import (
+    AccountLease,
+    release_account,
+    renew_account,
+    wait_for_account,
+)
+from app.services.redis.download_dedup import (
+    acquire_download,
+    complete_download,
+    download_dedup_key,
+    release_download,
+    renew_download,
+)
+from app.services.redis.lease import hold_lease, keep_alive
+from app.services.redis.link_cache import get_cached_link
+from app.services.redis.notifications import queue_notification
+from app.services.redis.proxy_backoff import backoff_level, record_download
+from app.services.redis.semaphore import download_limits, hold_slots
+from app.services.redis.task_progress import ProgressPublisher, publish_progress
+from app.services.redis.task_status import set_task_status
+from app.services.redis.video_index import register_video, wait_for_capacity
+from app.services.ytdlp.accounts import (
+    account_options,
+    configured_accounts,
+    is_account_error,
+)
+from app.services.ytdlp.formats import (
+    MERGE_OUTPUT_FORMAT,
+    download_format_sort,
+    estimate_download_bytes,
+    is_heavy_selection,
+    is_mp4_compatible,
+)
+from app.services.ytdlp.identity import site_key, video_key
+from app.services.ytdlp.transfer import transfer_options
 from app.settings import settings
-from app.tasks.broker import broker
-from app.utils.http import notify_bot_upload
+from app.tasks.broker import broker, create_download_pool
+from app.tasks.dependencies import get_redis_pool
+from app.tasks.queues import DEFAULT_QUEUE, HEAVY_QUEUES, download_queue
 
 settings.download_dir.mkdir(parents=True, exist_ok=True)
 
+OUTPUT_FORMAT = "mp4"
+# Downloads in progress, one directory per task. Kept on the videos'
+# volume so the finished file is moved, not copied, and partial files
+# survive the worker
+PARTIAL_DIR = settings.download_dir / ".partial"
+# Held by the execution of a task that may touch its working directory
+WORK_DIR_LEASE_PREFIX = "download:workdir"
+
+
+class HeavyDownloadError(Exception):
+    """A download on a light queue turned out to be long or large."""
+
+
+@dataclass
+class DownloadResult:
+    """Outcome of a download, passed back from the download process."""
+
+    filename: str
+    size: int
+    # Seconds spent in each postprocessing stage (merge, remux)
+    stage_seconds: dict[str, float]
+
+
+def partial_download_dir(task_id: str) -> Path:
+    """Working directory of a task's download."""
+    return PARTIAL_DIR / task_id
+
+
+def work_dir_lease_key(task_id: str) -> str:
+    """Redis key of the lease on a task's working directory."""
+    return f"{WORK_DIR_LEASE_PREFIX}:{task_id}"
+
+
+def _download(
+    url: str,
+    res: str,
+    task_id: str,
+    account: str | None,
+    transfer_opts: dict[str, Any],
+    heavy: bool,
+) -> DownloadResult:
+    """
+    Download and merge the video with yt-dlp.
+
+    Works in the task's own directory, so a redelivered task (its worker
+    was killed) continues the ``.part`` files and fragments where they
+    stopped. The finished file is moved to download_dir.
+
+    Raises HeavyDownloadError before downloading anything if a download
+    running on a light worker (``heavy`` False) is long or large.
+
+    Blocking, runs in the worker's download process pool.
+    """
+    work_dir = partial_download_dir(task_id)
+    progress = ProgressPublisher(task_id)
+    if work_dir.exists():
+        logger.info(f"Resuming download of {url}")
+    else:
+        logger.info(f"Downloading video: {url}")
+
+    ydl_opts = {
+        "format": "bestvideo+bestaudio/best",
+        "format_sort": download_format_sort(res),
+        "merge_output_format": MERGE_OUTPUT_FORMAT,
+        "outtmpl": str(work_dir / f"{task_id}.%(ext)s"),
+        # Partial files and fragments of an earlier attempt are continued
+        "continuedl": True,
+        "quiet": True,
+        "progress_hooks": [progress.hook],
+        "postprocessor_hooks": [progress.postprocessor_hook],
+        **transfer_opts,
+    }
+
+    if account is not None:
+        ydl_opts.update(account_options(account))
+
+    try:
+        progress.publish({"stage": "extract"})
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if not heavy and is_heavy_selection(info):
+                raise HeavyDownloadError(url)
+            if is_mp4_compatible(info):
+                # A single file in another container only needs its
+                # streams copied. Anything else is left for transcode_video
+                ydl.add_post_processor(
+                    FFmpegVideoRemuxerPP(ydl, preferedformat=OUTPUT_FORMAT),
+                    when="post_process",
+                )
+            info = ydl.process_ie_result(info, download=True)
+    finally:
+        progress.close()
+
+    filepath = Path(info["requested_downloads"][-1]["filepath"])
+    basename = filepath.name
+    target = settings.download_dir / basename
+    filepath.replace(target)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    logger.info(f"Downloaded video: {basename}")
+
+    return DownloadResult(
+        filename=basename,
+        size=target.stat().st_size,
+        stage_seconds=progress.stage_seconds,
+    )
+
+
+async def _reserve_bytes(redis: Redis, url: str, res: str) -> int:
+    """
+    Room to make for a download before it starts.
+
+    Uses the size of the formats from a cached link extraction, doubled
+    because the downloaded parts and the merged file exist side by side
+    until the merge is done. ``download_reserve_bytes`` if the size is not
+    known.
+    """
+    link = await get_cached_link(redis, video_key(url))
+    size = link and estimate_download_bytes(link, res)
+    if not size:
+        return settings.download_reserve_bytes
+    return 2 * size
+
+
+async def _run_download(context: Context, *args: Any) -> DownloadResult:
+    """
+    Run ``_download`` in the worker's process pool.
+
+    A download process that dies (OOM killer) breaks the whole pool, and
+    every download running in it fails. The pool is replaced then, and the
+    download retried once in the new one, continuing its partial files.
+    """
+    loop = asyncio.get_running_loop()
+    pool = context.state.download_pool
+    try:
+        return await loop.run_in_executor(pool, _download, *args)
+    except BrokenProcessPool:
+        # Only the first of the downloads that broke with it replaces it
+        if context.state.download_pool is pool:
+            logger.error("A download process died, restarting the download pool")
+            metrics.inc("download_pool_restarts_total")
+            context.state.download_pool = create_download_pool()
+            pool.shutdown(wait=False, cancel_futures=True)
+    return await loop.run_in_executor(context.state.download_pool, _download, *args)
+
+
+def _keep_account(
+    redis_pool: ConnectionPool,
+    lease: AccountLease | None,
+) -> AbstractAsyncContextManager[None]:
+    """Keep an account lease alive while the block runs."""
+    if lease is None:
+        return nullcontext()
+
+    async def renew() -> bool:
+        async with Redis(connection_pool=redis_pool) as redis:
+            return await renew_account(redis, lease, settings.worker_lease_seconds)
+
+    return keep_alive(renew, f"account {lease.account}")
+
+
+async def _download_as_account(
+    context: Context,
+    redis_pool: ConnectionPool,
+    url: str,
+    res: str,
+    task_id: str,
+    heavy: bool,
+) -> DownloadResult:
+    """
+    Download in the process pool with the healthiest available account.
+
+    Holds a slot of the account's proxy and of the site for the download.
+    Fragment concurrency is scaled back while the proxy keeps failing.
+    """
+    lease: AccountLease | None = None
+    if accounts := configured_accounts():
+        async with Redis(connection_pool=redis_pool) as redis:
+            lease = await wait_for_account(
+                redis,
+                accounts,
+                settings.worker_lease_seconds,
+                settings.account_wait_timeout_seconds,
+            )
+
+    account = lease and lease.account
+    proxy = settings.cookie_proxy_map.get(account) if account else None
+    site = site_key(url)
+    limits = download_limits(proxy, site)
+    error: BaseException | None = None
+    try:
+        # Waits (stays queued) while the proxy or the site is busy
+        async with (
+            _keep_account(redis_pool, lease),
+            Redis(connection_pool=redis_pool) as redis,
+            hold_slots(redis, limits, settings.worker_lease_seconds),
+        ):
+            level = await backoff_level(redis, proxy)
+            if level:
+                logger.info(
+                    f"Fewer parallel fragments after proxy errors (level {level}): {url}"
+                )
+            return await _run_download(
+                context,
+                url,
+                res,
+                task_id,
+                account,
+                transfer_options(site, level),
+                heavy,
+            )
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        if error is None or isinstance(error, Exception):
+            async with Redis(connection_pool=redis_pool) as redis:
+                await record_download(
+                    redis,
+                    proxy,
+                    error is not None and is_account_error(error),
+                )
+        if lease is not None:
+            async with Redis(connection_pool=redis_pool) as redis:
+                tripped = await release_account(
+                    redis,
+                    lease,
+                    error,
+                    error is not None and is_account_error(error),
+                )
+            if tripped:
+                logger.warning(
+                    f"Account {lease.account} taken out of rotation: {error}"
+                )
+                metrics.inc("account_trips_total", account=hashed_label(lease.account))
+
+
+async def _transcode(source: Path, target: Path) -> None:
+    """Re-encode a video into H.264/AAC MP4 with ffmpeg."""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(source),
+        "-c:v",
+        "libx264",
+        "-preset",
+        settings.transcode_preset,
+        "-crf",
+        str(settings.transcode_crf),
+        "-c:a",
+        "aac",
+        "-movflags",
+        "+faststart",
+        str(target),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await process.communicate()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if process.returncode:
+        raise RuntimeError(
+            f"ffmpeg exited with {process.returncode}: "
+            f"{stderr.decode(errors='replace').strip()}"
+        )
+
+
+def _keep_claim(
+    redis_pool: ConnectionPool,
+    dedup_key: str,
+    task_id: str,
+) -> AbstractAsyncContextManager[None]:
+    """Keep a task's dedup claim alive while the block runs."""
+
+    async def renew() -> bool:
+        async with Redis(connection_pool=redis_pool) as redis:
+            return await renew_download(
+                redis,
+                dedup_key,
+                task_id,
+                settings.worker_lease_seconds,
+            )
+
+    return keep_alive(renew, dedup_key)
+
+
+async def _store_video(
+    redis_pool: ConnectionPool,
+    dedup_key: str,
+    basename: str,
+    size: int,
+) -> dict[str, dict[str, Any]]:
+    """
+    Publish a new file for reuse and index it for expiry and eviction.
+
+    Returns the tasks that waited for it.
+    """
+    async with Redis(connection_pool=redis_pool) as redis:
+        waiters = await complete_download(redis, dedup_key, basename)
+        await register_video(
+            redis,
+            basename,
+            time.time() + settings.video_storage_minutes * 60,
+            size,
+        )
+    return waiters
+
+
+async def _finish_task(
+    redis_pool: ConnectionPool,
+    task_id: str,
+    dedup_key: str,
+    basename: str,
+    notify: bool,
+) -> str:
+    """Hand the video URL to the client of a task. Returns the URL."""
+    video_url = f"{settings.video_base_url}/{basename}"
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        # A reused file expires together with its dedup entry
+        ttl = await redis.ttl(dedup_key)
+        if ttl <= 0:
+            ttl = settings.video_storage_minutes * 60
+        await redis.set(f"task:url:{task_id}", video_url, ex=ttl)
+        await publish_progress(redis, task_id, {"stage": "done", "url": video_url})
+        if notify:
+            # Sent by deliver_notifications, the bot being down doesn't
+            # fail the download
+            await queue_notification(redis, task_id, video_url)
+    return video_url
+
+
+async def _serve_waiters(
+    redis_pool: ConnectionPool,
+    waiters: dict[str, dict[str, Any]],
+    dedup_key: str,
+    basename: str,
+) -> None:
+    """Hand a finished video to the tasks that waited for it."""
+    for task_id, request in waiters.items():
+        metrics.inc("downloads_total", result="reused")
+        await _finish_task(redis_pool, task_id, dedup_key, basename, request["notify"])
+
+
+async def _requeue_waiters(waiters: dict[str, dict[str, Any]]) -> None:
+    """Queue the tasks that waited for a failed download again."""
+    for task_id, request in waiters.items():
+        await (
+            download_video.kicker()
+            .with_task_id(task_id)
+            .with_labels(queue_name=request["queue"])
+            .kiq(request["url"], request["res"], notify=request["notify"])
+        )
+
 
 @broker.task
 async def download_video(
@@ -20,54 +425,237 @@ async def download_video(
     res: str,
     notify: bool = False,
     context: Context = TaskiqDepends(),
-) -> str:
-    """Download video from URL via yt-dlp. Returns the filename (basename)."""
-    try:
-        filename: str = uuid4().hex
-        logger.info(f"Downloading video: {url}")
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+) -> str | None:
+    """
+    Download video from URL via yt-dlp. Returns the filename (basename).
+
+    Returns None if the video was already being downloaded: the task that
+    downloads it reports the result under this task's id too. Also None
+    when a download on a light queue turns out long or large, it is sent
+    on to a heavy queue under the same task id.
 
-        ydl_opts = {
-            "format": "bestvideo+bestaudio/best",
-            "format_sort": [f"res:{res}"],
-            "merge_output_format": "mp4",
-            "outtmpl": str(settings.download_dir / f"{filename}.%(ext)s"),
-            "quiet": True,
-            "postprocessors": [
-                {
-                    "key": "FFmpegVideoConvertor",
-                    "preferedformat": "mp4",
-                },
-            ],
+    A task taken over from a worker that only seemed dead may still be
+    running there. Both copies would write (and delete) the same partial
+    files, so a copy waits until the other's lease on the task is gone.
+    It then resumes the partial files, or finds the video done.
+    """
+    task_id = context.message.task_id
+    lease_key = work_dir_lease_key(task_id)
+    async with (
+        Redis(connection_pool=redis_pool) as redis,
+        hold_lease(redis, lease_key, f"the work directory of {task_id}"),
+    ):
+        return await _download_video(url, res, notify, context, redis_pool)
+
+
+async def _download_video(
+    url: str,
+    res: str,
+    notify: bool,
+    context: Context,
+    redis_pool: ConnectionPool,
+) -> str | None:
+    """Body of ``download_video``, run while holding the task's lease."""
+    task_id = context.message.task_id
+    # Once the client has its URL (or the transcode task took over),
+    # later errors must not report the task as failed
+    reported = False
+    try:
+        dedup_key = download_dedup_key(video_key(url), res, OUTPUT_FORMAT)
+        request = {
+            "url": url,
+            "res": res,
+            "notify": notify,
+            "queue": context.message.labels.get("queue_name", DEFAULT_QUEUE),
         }
 
-        cookie_file = random.choice(list(settings.cookie_proxy_map.keys()))
-        logger.info(f"Using cookie file: {cookie_file}")
-        cookie_path = settings.cookies_dir / cookie_file
-        if cookie_path.exists():
-            ydl_opts["cookiefile"] = str(cookie_path)
+        # Reuse the file if someone already downloaded (or is downloading) it
+        async with Redis(connection_pool=redis_pool) as redis:
+            claim = await acquire_download(redis, dedup_key, task_id, request)
+        if claim.waiting:
+            logger.info(f"Video is already being downloaded, handed over: {url}")
+            return None
+
+        basename = claim.filename
+        if claim.claimed:
+            try:
+                async with (
+                    _keep_claim(redis_pool, dedup_key, task_id),
+                    # Downloads the process pool can't run yet wait here,
+                    # before they take disk space, accounts and slots
+                    context.state.download_admission,
+                ):
+                    # Evict old videos first, or wait if nothing can be evicted
+                    async with Redis(connection_pool=redis_pool) as redis:
+                        needed = await _reserve_bytes(redis, url, res)
+                        await wait_for_capacity(redis, needed)
+
+                    start = time.perf_counter()
+                    result = await _download_as_account(
+                        context,
+                        redis_pool,
+                        url,
+                        res,
+                        task_id,
+                        heavy=request["queue"] in HEAVY_QUEUES,
+                    )
+                basename = result.filename
+                if not basename.endswith(f".{OUTPUT_FORMAT}"):
+                    # Codecs MP4 can't carry, re-encoding runs as its own task
+                    async with Redis(connection_pool=redis_pool) as redis:
+                        await publish_progress(redis, task_id, {"stage": "transcode"})
+                        # Nobody renews the claim while the transcode is queued
+                        await renew_download(
+                            redis,
+                            dedup_key,
+                            task_id,
+                            settings.download_claim_seconds,
+                        )
+                    # Re-encoding is always slow, keep it off the light workers
+                    await (
+                        transcode_video.kicker()
+                        .with_labels(queue_name=download_queue(notify, heavy=True))
+                        .kiq(basename, task_id, dedup_key, notify=notify)
+                    )
+                    reported = True
+            except HeavyDownloadError:
+                # The same task continues on a heavy queue. The claim stays
+                # with it while it is queued
+                queue = download_queue(notify, heavy=True)
+                async with Redis(connection_pool=redis_pool) as redis:
+                    await renew_download(
+                        redis,
+                        dedup_key,
+                        task_id,
+                        settings.download_claim_seconds,
+                    )
+                    await set_task_status(redis, task_id, "queued", queue=queue)
+                await (
+                    download_video.kicker()
+                    .with_task_id(task_id)
+                    .with_labels(queue_name=queue)
+                    .kiq(url, res, notify=notify)
+                )
+                metrics.inc("downloads_total", result="moved_to_heavy")
+                logger.info(f"Long or large video, moved to {queue}: {url}")
+                return None
+            except BaseException as exc:
+                metrics.inc("downloads_total", result="failed")
+                if isinstance(exc, Exception):
+                    # Failed tasks aren't retried. Only a cancelled or
+                    # killed one comes back and resumes its partial files
+                    await asyncio.to_thread(
+                        shutil.rmtree,
+                        partial_download_dir(task_id),
+                        ignore_errors=True,
+                    )
+                    # Tasks that waited for this one try for themselves
+                    async with Redis(connection_pool=redis_pool) as redis:
+                        await _requeue_waiters(
+                            await release_download(redis, dedup_key, task_id),
+                        )
+                raise
+            metrics.inc("downloads_total", result="downloaded")
+            metrics.inc("download_bytes_total", result.size)
+            metrics.observe(
+                "download_duration_seconds",
+                time.perf_counter() - start,
+                DURATION_BUCKETS,
+            )
+            for stage, seconds in result.stage_seconds.items():
+                metrics.observe(
+                    "postprocess_duration_seconds",
+                    seconds,
+                    DURATION_BUCKETS,
+                    stage=stage,
+                )
+            if reported:
+                logger.info(f"Queued transcoding of {basename} for {url}")
+                return basename
+            waiters = await _store_video(redis_pool, dedup_key, basename, result.size)
         else:
-            logger.warning(f"Cookie file not found: {cookie_path}")
+            metrics.inc("downloads_total", result="reused")
+            logger.info(f"Reusing downloaded video {basename} for {url}")
+            waiters = {}
 
-        proxy = settings.cookie_proxy_map.get(cookie_file)
-        if proxy:
-            ydl_opts["proxy"] = proxy
-            logger.info(f"Using proxy for {cookie_file}: {proxy}")
+        await _finish_task(redis_pool, task_id, dedup_key, basename, notify)
+        reported = True
+        await _serve_waiters(redis_pool, waiters, dedup_key, basename)
+        return basename
+    except Exception as exc:
+        logger.error(f"Failed to download video: {exc}")
+        if not reported:
+            async with Redis(connection_pool=redis_pool) as redis:
+                await publish_progress(
+                    redis,
+                    task_id,
+                    {"stage": "failed", "error": type(exc).__name__},
+                )
+        raise
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filepath = Path(info["requested_downloads"][-1]["filepath"])
-            basename = filepath.name
-            logger.info(f"Downloaded video: {basename}")
 
-        task_id = context.message.task_id
-        video_url = f"{settings.video_base_url}/{basename}"
-        ttl = settings.video_storage_minutes * 60
+@broker.task
+async def transcode_video(
+    filename: str,
+    download_task_id: str,
+    dedup_key: str,
+    notify: bool = False,
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+) -> str:
+    """
+    Re-encode a downloaded video into MP4. Returns the new filename.
+
+    Only for videos whose codecs can't be copied into MP4. CPU heavy, so it
+    is queued separately from downloads. The result is reported under the
+    download task's id.
+    """
+    source = settings.download_dir / filename
+    target = source.with_suffix(f".{OUTPUT_FORMAT}")
+    reported = False
 
-        async with Redis.from_url(str(settings.redis_url)) as redis:
-            await redis.set(f"task:url:{task_id}", video_url, ex=ttl)
+    try:
+        try:
+            start = time.perf_counter()
+            async with _keep_claim(redis_pool, dedup_key, download_task_id):
+                await _transcode(source, target)
+        except BaseException as exc:
+            metrics.inc("transcodes_total", result="failed")
+            target.unlink(missing_ok=True)
+            if isinstance(exc, Exception):
+                async with Redis(connection_pool=redis_pool) as redis:
+                    await _requeue_waiters(
+                        await release_download(redis, dedup_key, download_task_id),
+                    )
+            raise
+        finally:
+            source.unlink(missing_ok=True)
+        metrics.inc("transcodes_total", result="transcoded")
+        metrics.observe(
+            "postprocess_duration_seconds",
+            time.perf_counter() - start,
+            DURATION_BUCKETS,
+            stage="transcode",
+        )
 
-        if notify:
-            await notify_bot_upload(task_id, video_url)
+        waiters = await _store_video(
+            redis_pool,
+            dedup_key,
+            target.name,
+            target.stat().st_size,
+        )
+        await _finish_task(redis_pool, download_task_id, dedup_key, target.name, notify)
+        reported = True
+        logger.info(f"Transcoded {filename} to {target.name}")
+        await _serve_waiters(redis_pool, waiters, dedup_key, target.name)
+        return target.name
     except Exception as exc:
-        logger.error(f"Failed to download video: {exc}")
+        logger.error(f"Failed to transcode video {filename}: {exc}")
+        if not reported:
+            async with Redis(connection_pool=redis_pool) as redis:
+                await publish_progress(
+                    redis,
+                    download_task_id,
+                    {"stage": "failed", "error": type(exc).__name__},
+                )
         raise
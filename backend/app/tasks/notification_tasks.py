@@ -0,0 +1,102 @@
+import asyncio
+import time
+
+import httpx
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis
+from taskiq import TaskiqDepends
+
+from app.services.metrics import metrics
+from app.services.redis.notifications import (
+    claim_notifications,
+    finish_notifications,
+    retry_notifications,
+)
+from app.settings import settings
+from app.tasks.broker import broker
+from app.tasks.dependencies import get_http_client, get_redis_pool
+from app.tasks.queues import MAINTENANCE_QUEUE
+from app.utils.http import notify_bot_upload, notify_bot_uploads
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Bot down, overloaded or unreachable, as opposed to rejecting the upload."""
+    if isinstance(error, httpx.HTTPStatusError):
+        code = error.response.status_code
+        return code >= 500 or code in (408, 429)
+    return True
+
+
+async def _send(
+    client: httpx.AsyncClient,
+    batch: list[tuple[str, str, int]],
+) -> list[Exception | None]:
+    """Send a batch of notifications. Returns the error of each, if any."""
+    if settings.tg_bot_batch_url:
+        try:
+            uploads = [(task_id, url) for task_id, url, _ in batch]
+            await notify_bot_uploads(client, uploads)
+        except Exception as exc:
+            return [exc] * len(batch)
+        return [None] * len(batch)
+    return await asyncio.gather(
+        *(notify_bot_upload(client, task_id, url) for task_id, url, _ in batch),
+        return_exceptions=True,
+    )
+
+
+async def _deliver(
+    redis: Redis,
+    client: httpx.AsyncClient,
+    batch: list[tuple[str, str, int]],
+) -> int:
+    """Send a batch and retry or drop what failed. Returns the number sent."""
+    sent: list[str] = []
+    dropped: list[str] = []
+    retries: list[tuple[str, int]] = []
+    errors = await _send(client, batch)
+    for (task_id, _, attempts), error in zip(batch, errors, strict=True):
+        if error is None:
+            sent.append(task_id)
+        elif _is_retryable(error) and attempts + 1 < settings.notify_max_attempts:
+            logger.warning(
+                f"Failed to notify bot for task {task_id}, will retry: {error}"
+            )
+            retries.append((task_id, attempts))
+        else:
+            logger.error(f"Gave up notifying bot for task {task_id}: {error}")
+            dropped.append(task_id)
+
+    if sent or dropped:
+        await finish_notifications(redis, sent + dropped)
+    if retries:
+        await retry_notifications(redis, retries)
+    outcomes = {"sent": sent, "retried": retries, "dropped": dropped}
+    for result, task_ids in outcomes.items():
+        if task_ids:
+            metrics.inc("bot_notifications_total", len(task_ids), result=result)
+    return len(sent)
+
+
+@broker.task(schedule=[{"cron": "* * * * *"}], queue_name=MAINTENANCE_QUEUE)
+async def deliver_notifications(
+    redis_pool: ConnectionPool = TaskiqDepends(get_redis_pool),
+    http_client: httpx.AsyncClient = TaskiqDepends(get_http_client),
+) -> int:
+    """
+    Send finished downloads to the bot.
+
+    Download tasks only queue their notification, so a slow or broken bot
+    can't fail them. Started every minute and polls the queue every
+    notify_poll_seconds until the next run takes over. Returns count sent.
+    """
+    deadline = time.monotonic() + 60 - settings.notify_poll_seconds
+    delivered = 0
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        while True:
+            while batch := await claim_notifications(redis, settings.notify_batch_size):
+                delivered += await _deliver(redis, http_client, batch)
+            if time.monotonic() >= deadline:
+                return delivered
+            await asyncio.sleep(settings.notify_poll_seconds)
@@ -0,0 +1,33 @@
+# Redis streams tasks are sent to. Tasks without a queue label go to the
+# broker's default stream
+DEFAULT_QUEUE = "taskiq"
+# Downloads are queued by who asked for them, the API key (the Telegram
+# bot) or the website, and by how long they take. Light and heavy ones
+# are read by separate workers, so short clips don't wait behind long
+# videos
+BOT_LIGHT_QUEUE = "downloads:bot:light"
+BOT_HEAVY_QUEUE = "downloads:bot:heavy"
+WEB_LIGHT_QUEUE = "downloads:web:light"
+WEB_HEAVY_QUEUE = "downloads:web:heavy"
+# Periodic tasks. Several of them poll for the whole minute until their
+# next run, so they get a worker of their own instead of taking slots
+# from downloads
+MAINTENANCE_QUEUE = "maintenance"
+
+QUEUES = (
+    DEFAULT_QUEUE,
+    BOT_LIGHT_QUEUE,
+    BOT_HEAVY_QUEUE,
+    WEB_LIGHT_QUEUE,
+    WEB_HEAVY_QUEUE,
+    MAINTENANCE_QUEUE,
+)
+
+HEAVY_QUEUES = (BOT_HEAVY_QUEUE, WEB_HEAVY_QUEUE)
+
+
+def download_queue(authenticated: bool, heavy: bool) -> str:
+    """Stream a download is sent to."""
+    if authenticated:
+        return BOT_HEAVY_QUEUE if heavy else BOT_LIGHT_QUEUE
+    return WEB_HEAVY_QUEUE if heavy else WEB_LIGHT_QUEUE
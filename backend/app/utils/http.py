@@ -4,13 +4,34 @@ from loguru import logger
 from app.settings import settings
 
 
-async def notify_bot_upload(task_id: str, video_url: str) -> None:
+async def notify_bot_upload(
+    client: httpx.AsyncClient,
+    task_id: str,
+    video_url: str,
+) -> None:
     """POST to the telegram bot /api/upload endpoint with the video URL."""
     headers = {"X-API-Key": settings.download_api_key}
     payload = {"task_id": task_id, "url": video_url}
 
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(settings.tg_bot_base_url, json=payload, headers=headers)
-        resp.raise_for_status()
+    resp = await client.post(settings.tg_bot_base_url, json=payload, headers=headers)
+    resp.raise_for_status()
 
     logger.info(f"Notified bot for task {task_id}")
+
+
+async def notify_bot_uploads(
+    client: httpx.AsyncClient,
+    uploads: list[tuple[str, str]],
+) -> None:
+    """POST several (task id, video URL) pairs to the bot's batch endpoint."""
+    headers = {"X-API-Key": settings.download_api_key}
+    payload = {
+        "uploads": [
+            {"task_id": task_id, "url": video_url} for task_id, video_url in uploads
+        ],
+    }
+
+    resp = await client.post(settings.tg_bot_batch_url, json=payload, headers=headers)
+    resp.raise_for_status()
+
+    logger.info(f"Notified bot for {len(uploads)} tasks")
@@ -1,10 +1,61 @@
+import asyncio
+import mimetypes
 import random
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import FileResponse
+import time
+from collections.abc import AsyncGenerator, AsyncIterator
+from email.utils import parsedate
+from urllib.parse import quote
+from uuid import uuid4
+
+import httpx
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import RedisError
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
 from app.utils.common import api_key_or_rate_limit
-from app.services.redis.rate_limit import rate_limit_download
+from app.services.metrics import DURATION_BUCKETS, hashed_label, metrics
+from app.services.redis.account_pool import (
+    AccountLease,
+    NoAccountAvailableError,
+    acquire_account,
+    release_account,
+)
+from app.services.redis.link_cache import (
+    ExtractionFailedError,
+    get_cached_link,
+    get_or_extract_link,
+)
+from app.services.redis.rate_limit import rate_limit_download, rate_limit_stream
+from app.services.redis.semaphore import (
+    ConcurrencyLimitError,
+    extraction_limits,
+    hold_slots,
+)
+from app.services.redis.task_progress import stream_progress, wait_for_task_url
+from app.services.redis.task_status import (
+    get_task_status,
+    set_task_status,
+    task_status_key,
+)
+from app.services.redis.video_index import touch_video
+from app.services.streaming.clients import StreamClients
+from app.services.streaming.dependency import get_stream_clients, get_stream_links
+from app.services.streaming.links import StreamLinks
+from app.services.streaming.mux import MuxError, TrackMuxer
+from app.services.ytdlp.accounts import (
+    account_options,
+    configured_accounts,
+    is_account_error,
+)
+from app.services.ytdlp.dependency import get_extraction_executor
+from app.services.ytdlp.executor import ExtractionExecutor, ExtractionQueueFullError
+from app.services.ytdlp.formats import is_heavy_download
+from app.services.ytdlp.identity import site_key, video_key
 from app.tasks.download_tasks import download_video as download_video_task
+from app.tasks.queues import download_queue
 from app.web.api.download.schema import DownloadRequest
 from app.settings import settings
 import yt_dlp
@@ -15,119 +66,629 @@ files_router = APIRouter()
 
 _download_dir = settings.download_dir.resolve()
 
+# Formats /stream can fetch with a plain GET (not HLS/DASH manifests)
+_STREAMABLE_PROTOCOLS = ("http", "https")
+
+# Upstream response headers passed on by /stream
+_STREAM_HEADERS = (
+    "content-length",
+    "content-range",
+    "accept-ranges",
+    "last-modified",
+    "etag",
+)
+
+
+def _content_disposition(filename: str) -> str:
+    """Attachment header for a filename that may not be ASCII."""
+    filename = filename.replace("/", "_").replace("\\", "_")
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _is_not_modified(response_headers: Headers, request_headers: Headers) -> bool:
+    """Check the request's validators against the file's ETag and Last-Modified."""
+    if if_none_match := request_headers.get("if-none-match"):
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return response_headers["etag"] in tags
+
+    if_modified_since = parsedate(request_headers.get("if-modified-since", ""))
+    last_modified = parsedate(response_headers["last-modified"])
+    return (
+        if_modified_since is not None
+        and last_modified is not None
+        and if_modified_since >= last_modified
+    )
+
 
 @files_router.get("/videos/{filename:path}")
-async def serve_video(filename: str) -> FileResponse:
+async def serve_video(filename: str, request: Request) -> Response:
     file_path = (_download_dir / filename).resolve()
-    if not str(file_path).startswith(str(_download_dir)):
+    # Only finished videos, not the partial downloads in subdirectories
+    if file_path.parent != _download_dir:
         raise HTTPException(status_code=404)
     if not file_path.is_file():
         raise HTTPException(status_code=404)
-    return FileResponse(
+
+    # Recently served files are the last to be evicted
+    redis_pool: ConnectionPool = request.app.state.redis_pool
+    try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            await touch_video(redis, file_path.name)
+    except RedisError as exc:
+        logger.warning(f"Failed to record access to {file_path.name}: {exc}")
+
+    media_type = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+    headers = {"Content-Disposition": f'attachment; filename="{file_path.name}"'}
+
+    if settings.video_sendfile_header:
+        # The front proxy sends the bytes and handles ranges and validators
+        if settings.video_sendfile_header.lower() == "x-accel-redirect":
+            target = (
+                f"{settings.video_accel_redirect_prefix.rstrip('/')}/{file_path.name}"
+            )
+        else:
+            target = str(file_path)
+        headers[settings.video_sendfile_header] = target
+        return Response(media_type=media_type, headers=headers)
+
+    # FileResponse adds ETag/Last-Modified and answers Range requests with 206
+    response = FileResponse(
         path=file_path,
-        media_type="application/octet-stream",
-        headers={"Content-Disposition": f'attachment; filename="{file_path.name}"'},
+        media_type=media_type,
+        headers=headers,
+        stat_result=await asyncio.to_thread(file_path.stat),
     )
+    if _is_not_modified(response.headers, request.headers):
+        return NotModifiedResponse(response.headers)
+    return response
 
 
-@router.get("/get_download_link", dependencies=[Depends(rate_limit_download)])
-async def download_video_link(url: str) -> dict:
-    """Get direct video URL without downloading."""
+def _filesize(fmt: dict) -> int | None:
+    """Exact size of a format, or the site's estimate."""
+    return fmt.get("filesize") or fmt.get("filesize_approx")
+
+
+def _extract_download_link(url: str, ydl_opts: dict) -> dict:
+    """Run yt-dlp extraction and pick the formats we expose. Blocking."""
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    # One entry per unique height — prefer muxed (audio+video) over video-only
+    seen_heights: set[int | None] = set()
+    resolutions: list[dict] = []
+    url: str = ""
+    ext: str = ""
+    filesize: int | None = None
+    http_headers: dict = {}
+    protocol: str = ""
+    main_resolution: str = ""
+    formats = info.get("formats", [])
 
+    # First pass: muxed formats (have both video and audio)
+    for fmt in reversed(formats):
+        if fmt.get("vcodec") in (None, "none") or fmt.get("acodec") in (None, "none"):
+            continue
+        height = fmt.get("height")
+        if height in seen_heights:
+            continue
+        seen_heights.add(height)
+        url = fmt.get("url")
+        ext = fmt.get("ext")
+        filesize = _filesize(fmt)
+        http_headers = fmt.get("http_headers") or {}
+        protocol = fmt.get("protocol")
+        main_resolution = fmt.get("height")
+
+    # Second pass: video-only formats for heights not covered by muxed
+    for fmt in reversed(formats):
+        if fmt.get("vcodec") in (None, "none"):
+            continue
+        if fmt.get("acodec") not in (None, "none"):
+            continue
+        height = fmt.get("height")
+        if height in seen_heights:
+            continue
+        seen_heights.add(height)
+        resolutions.append(
+            {
+                "format_id": fmt.get("format_id"),
+                "height": height,
+                "ext": fmt.get("ext"),
+                "fps": fmt.get("fps"),
+                "filesize": _filesize(fmt),
+                "url": fmt.get("url"),
+                "http_headers": fmt.get("http_headers"),
+                "protocol": fmt.get("protocol"),
+            }
+        )
+
+    resolutions.sort(key=lambda f: f["height"] or 0, reverse=True)
+
+    # Best audio-only format, muxed with a video-only one when streaming.
+    # AAC first, it goes into MP4 for every player
+    audio_formats = [
+        fmt
+        for fmt in reversed(formats)
+        if fmt.get("vcodec") in (None, "none")
+        and fmt.get("acodec") not in (None, "none")
+    ]
+    audio_formats.sort(key=lambda f: f.get("ext") != "m4a")
+    audio = None
+    if audio_formats:
+        audio = {
+            "format_id": audio_formats[0].get("format_id"),
+            "ext": audio_formats[0].get("ext"),
+            "filesize": _filesize(audio_formats[0]),
+            "url": audio_formats[0].get("url"),
+            "http_headers": audio_formats[0].get("http_headers"),
+            "protocol": audio_formats[0].get("protocol"),
+        }
+
+    return {
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "thumbnail": info.get("thumbnail"),
+        "url": url,
+        "ext": ext,
+        "filesize": filesize,
+        "http_headers": http_headers,
+        "protocol": protocol,
+        "main_resolution": main_resolution,
+        "resolutions": resolutions,
+        "audio": audio,
+    }
+
+
+async def _release_account(
+    redis_pool: ConnectionPool,
+    lease: AccountLease,
+    error: BaseException | None,
+    latency: float,
+) -> None:
+    """Report how an extraction went for the account it used."""
+    # Slow proxies show up as timeouts. Waiting for a slot is not the
+    # account's fault
+    account_error = (
+        error is not None
+        and not isinstance(error, ConcurrencyLimitError)
+        and (isinstance(error, TimeoutError) or is_account_error(error))
+    )
     try:
+        async with Redis(connection_pool=redis_pool) as redis:
+            tripped = await release_account(
+                redis,
+                lease,
+                error,
+                account_error,
+                latency=None if error else latency,
+            )
+    except RedisError as exc:
+        logger.warning(f"Failed to release account {lease.account}: {exc}")
+        return
+    if tripped:
+        logger.warning(f"Account {lease.account} taken out of rotation: {error}")
+        metrics.inc("account_trips_total", account=hashed_label(lease.account))
+
+
+async def _get_link_info(
+    url: str,
+    request: Request,
+    executor: ExtractionExecutor,
+) -> dict:
+    """
+    Extract the video's formats, or reuse a cached extraction.
+
+    The result includes the ``account`` (cookie file) the media URLs were
+    extracted with, which must not be exposed to clients.
+    """
+
+    redis_pool: ConnectionPool = request.app.state.redis_pool
+
+    async def extract() -> dict:
         ydl_opts = {
             "quiet": True,
         }
+        lease: AccountLease | None = None
+        account: str | None = None
 
-        if settings.cookie_proxy_map:
-            cookie_file = random.choice(list(settings.cookie_proxy_map.keys()))
-            cookie_path = settings.cookies_dir / cookie_file
-            if cookie_path.exists():
-                ydl_opts["cookiefile"] = str(cookie_path)
-                logger.info(f"Using cookie file: {cookie_file}")
-            else:
-                logger.warning(f"Cookie file not found: {cookie_path}")
-
-            proxy = settings.cookie_proxy_map.get(cookie_file)
-            if proxy:
-                ydl_opts["proxy"] = proxy
-                logger.info(f"Using proxy for {cookie_file}: {proxy}")
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-        # One entry per unique height — prefer muxed (audio+video) over video-only
-        seen_heights: set[int | None] = set()
-        resolutions: list[dict] = []
-        url: str = ""
-        ext: str = ""
-        main_resolution: str = ""
-        formats = info.get("formats", [])
-
-        # First pass: muxed formats (have both video and audio)
-        for fmt in reversed(formats):
-            if fmt.get("vcodec") in (None, "none") or fmt.get("acodec") in (None, "none"):
-                continue
-            height = fmt.get("height")
-            if height in seen_heights:
-                continue
-            seen_heights.add(height)
-            url = fmt.get("url")
-            ext = fmt.get("ext")
-            main_resolution = fmt.get("height")
-
-        # Second pass: video-only formats for heights not covered by muxed
-        for fmt in reversed(formats):
-            if fmt.get("vcodec") in (None, "none"):
-                continue
-            if fmt.get("acodec") not in (None, "none"):
-                continue
-            height = fmt.get("height")
-            if height in seen_heights:
-                continue
-            seen_heights.add(height)
-            resolutions.append(
-                {
-                    "format_id": fmt.get("format_id"),
-                    "height": height,
-                    "ext": fmt.get("ext"),
-                    "fps": fmt.get("fps"),
-                    "url": fmt.get("url"),
-                    "http_headers": fmt.get("http_headers"),
-                }
-            )
+        if accounts := configured_accounts():
+            try:
+                async with Redis(connection_pool=redis_pool) as redis:
+                    lease = await acquire_account(
+                        redis,
+                        accounts,
+                        settings.extraction_timeout_seconds * 2,
+                    )
+                account = lease.account
+            except RedisError as exc:
+                logger.warning(f"Account pool unavailable, picking at random: {exc}")
+                account = random.choice(accounts)
+            ydl_opts.update(account_options(account))
 
-        resolutions.sort(key=lambda f: f["height"] or 0, reverse=True)
+        limits = extraction_limits(
+            settings.cookie_proxy_map.get(account) if account else None,
+            site_key(url),
+        )
+        start = time.perf_counter()
+        error: BaseException | None = None
+        try:
+            async with (
+                Redis(connection_pool=redis_pool) as redis,
+                hold_slots(
+                    redis,
+                    limits,
+                    settings.extraction_timeout_seconds * 2,
+                    timeout=settings.extraction_timeout_seconds,
+                ),
+            ):
+                # Time spent waiting for a slot doesn't count
+                start = time.perf_counter()
+                # yt-dlp blocks, keep it off the event loop
+                data = await executor.run(_extract_download_link, url, ydl_opts)
+        except Exception as exc:
+            error = exc
+            metrics.inc("extraction_errors_total", error=type(exc).__name__)
+            raise
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            if lease is not None:
+                await _release_account(
+                    redis_pool,
+                    lease,
+                    error,
+                    time.perf_counter() - start,
+                )
+        metrics.observe(
+            "extraction_duration_seconds",
+            time.perf_counter() - start,
+            DURATION_BUCKETS,
+        )
+        # Media URLs may only work from the address that extracted them
+        data["account"] = account
+        return data
 
-        return {
-            "title": info.get("title"),
-            "duration": info.get("duration"),
-            "thumbnail": info.get("thumbnail"),
-            "url": url,
-            "ext": ext,
-            "main_resolution": main_resolution,
-            "resolutions": resolutions,
-        }
+    try:
+        try:
+            # Cached, or extracted once for all concurrent requests
+            return await get_or_extract_link(
+                redis_pool,
+                video_key(url),
+                extract,
+                # Busy or out of accounts, the video itself may be fine
+                uncached_errors=(
+                    NoAccountAvailableError,
+                    ConcurrencyLimitError,
+                    ExtractionQueueFullError,
+                ),
+                # Waiting for a slot and the extraction itself
+                timeout=settings.extraction_timeout_seconds * 2,
+            )
+        except RedisError as exc:
+            logger.warning(f"Link cache unavailable, extracting directly: {exc}")
+            return await extract()
+    except NoAccountAvailableError as exc:
+        logger.error(str(exc))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="No account available for extraction",
+            headers={"Retry-After": str(settings.account_circuit_seconds)},
+        )
+    except ConcurrencyLimitError:
+        logger.warning(f"Too many extractions for this site or proxy: {url}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many extractions in progress",
+            headers={"Retry-After": "5"},
+        )
+    except ExtractionQueueFullError:
+        logger.warning("Extraction queue is full, rejecting request")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many extractions in progress",
+            headers={"Retry-After": "5"},
+        )
+    except ExtractionFailedError as exc:
+        logger.warning(f"Extraction failed moments ago, not retrying yet: {url}: {exc}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Extraction failed",
+            headers={"Retry-After": str(settings.link_cache_error_seconds)},
+        )
+    except TimeoutError:
+        logger.error(f"Extraction timed out: {url}")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Extraction timed out",
+        )
     except Exception as exc:
         logger.error(f"Failed to get download link: {str(exc)}")
         raise
 
 
+@router.get("/get_download_link", dependencies=[Depends(rate_limit_download)])
+async def download_video_link(
+    url: str,
+    request: Request,
+    executor: ExtractionExecutor = Depends(get_extraction_executor),
+) -> dict:
+    """Get direct video URL without downloading."""
+    data = await _get_link_info(url, request, executor)
+    return {key: value for key, value in data.items() if key != "account"}
+
+
+def _pick_muxed_track(data: dict, res: int | None) -> dict | None:
+    """
+    Choose a video-only format to mux on the fly for ``res``.
+
+    Returns None when the single-file format is at least as good.
+    """
+    audio = data.get("audio")
+    if not audio or audio.get("protocol") not in _STREAMABLE_PROTOCOLS:
+        return None
+    candidates = [
+        fmt
+        for fmt in data.get("resolutions") or []
+        if fmt.get("height")
+        and fmt.get("protocol") in _STREAMABLE_PROTOCOLS
+        and (res is None or fmt["height"] <= res)
+    ]
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda fmt: fmt["height"])
+    if data.get("url") and (data.get("main_resolution") or 0) >= best["height"]:
+        return None
+    return best
+
+
+async def _counted(chunks: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+    """Pass chunks through, recording the streamed bytes."""
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc("stream_bytes_total", sent)
+
+
+@router.get("/stream", dependencies=[Depends(rate_limit_stream)])
+async def stream_video(
+    url: str,
+    request: Request,
+    res: int | None = Query(default=None, gt=0),
+    executor: ExtractionExecutor = Depends(get_extraction_executor),
+    clients: StreamClients = Depends(get_stream_clients),
+    links: StreamLinks = Depends(get_stream_links),
+) -> StreamingResponse:
+    """
+    Stream the video straight from the source, without downloading it first.
+
+    A single-file format is passed through and Range requests with it, so
+    players can seek. If ``res`` is only available as separate video and
+    audio, both are muxed on the fly into fragmented MP4, which can't seek.
+    The link stays resolved for the following seeks of the stream.
+    """
+    key = video_key(url)
+    data = links.get(key, res)
+    if data is None:
+        data = await _get_link_info(url, request, executor)
+        links.put(key, res, data)
+    proxy = settings.cookie_proxy_map.get(data.get("account") or "")
+    client = clients.get(proxy)
+    title = data.get("title") or "video"
+
+    if video := _pick_muxed_track(data, res):
+        muxer = TrackMuxer(client, video, data["audio"], settings.stream_chunk_bytes)
+        try:
+            await muxer.start()
+        except httpx.HTTPError as exc:
+            logger.error(f"Failed to open tracks for {url}: {exc}")
+            metrics.inc("stream_requests_total", result="failed")
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Failed to reach video source",
+            )
+        except MuxError as exc:
+            logger.error(str(exc))
+            metrics.inc("stream_requests_total", result="failed")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Muxing is unavailable, use /download",
+            )
+        metrics.inc("stream_requests_total", result="muxed")
+        return StreamingResponse(
+            _counted(muxer.chunks()),
+            media_type="video/mp4",
+            headers={"Content-Disposition": _content_disposition(f"{title}.mp4")},
+        )
+
+    if not data.get("url") or data.get("protocol") not in _STREAMABLE_PROTOCOLS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No format to stream, use /download",
+        )
+
+    headers = dict(data.get("http_headers") or {})
+    if range_header := request.headers.get("range"):
+        headers["Range"] = range_header
+
+    try:
+        upstream = await client.send(
+            client.build_request("GET", data["url"], headers=headers),
+            stream=True,
+        )
+    except httpx.HTTPError as exc:
+        logger.error(f"Failed to open stream for {url}: {exc}")
+        metrics.inc("stream_requests_total", result="failed")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to reach video source",
+        )
+    if upstream.status_code >= 400:
+        await upstream.aclose()
+        logger.error(f"Video source returned {upstream.status_code} for {url}")
+        metrics.inc("stream_requests_total", result="failed")
+        if upstream.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE:
+            raise HTTPException(status_code=upstream.status_code)
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Video source refused the request",
+        )
+    metrics.inc("stream_requests_total", result="streamed")
+
+    response_headers = {
+        name: upstream.headers[name]
+        for name in _STREAM_HEADERS
+        if name in upstream.headers
+    }
+    ext = data.get("ext") or "mp4"
+    response_headers["Content-Disposition"] = _content_disposition(f"{title}.{ext}")
+    media_type = upstream.headers.get("content-type") or (
+        mimetypes.guess_type(f"video.{ext}")[0] or "application/octet-stream"
+    )
+
+    async def body() -> AsyncGenerator[bytes, None]:
+        # One bounded chunk in memory at a time: the next upstream read waits
+        # until the client has taken the previous chunk
+        try:
+            async for chunk in upstream.aiter_raw(settings.stream_chunk_bytes):
+                yield chunk
+        finally:
+            await upstream.aclose()
+
+    return StreamingResponse(
+        _counted(body()),
+        status_code=upstream.status_code,
+        headers=response_headers,
+        media_type=media_type,
+    )
+
+
 @router.get("/get_url")
-async def get_url(task_id: str, request: Request) -> dict:
-    """Return video URL for a completed task, or not_ready if still processing."""
+async def get_url(
+    task_id: str,
+    request: Request,
+    wait: int = Query(default=0, ge=0, le=settings.get_url_max_wait_seconds),
+) -> dict:
+    """
+    Return video URL for a completed task, or not_ready if still processing.
+
+    With ``wait`` set, blocks up to that many seconds for the task to finish.
+    """
+    redis_pool: ConnectionPool = request.app.state.redis_pool
+    if wait:
+        event = await wait_for_task_url(redis_pool, task_id, wait)
+        if event is None:
+            return {"status": "not_ready"}
+        if event["stage"] == "failed":
+            return {"status": "failed"}
+        return {"url": event["url"]}
+
+    async with Redis(connection_pool=redis_pool) as redis:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(f"task:url:{task_id}")
+            pipe.hget(task_status_key(task_id), "status")
+            url, state = await pipe.execute()
+    if url:
+        return {"url": url.decode()}
+    if state == b"failed":
+        return {"status": "failed"}
+    return {"status": "not_ready"}
+
+
+@router.get("/task/{task_id}")
+async def get_task(task_id: str, request: Request) -> dict:
+    """
+    Return the status record of a task.
+
+    The status is one of queued, extracting, downloading, merging,
+    transcoding, done or failed, with a ``<status>_at`` unix time for every
+    status reached. Done tasks have the ``url``, failed ones the ``error``
+    class.
+    """
+    redis_pool: ConnectionPool = request.app.state.redis_pool
+    async with Redis(connection_pool=redis_pool) as redis:
+        record = await get_task_status(redis, task_id)
+    if record is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Unknown task"
+        )
+    return record
+
+
+@router.get("/progress")
+async def stream_task_progress(task_id: str, request: Request) -> StreamingResponse:
+    """Stream download progress of a task as Server-Sent Events."""
     redis_pool: ConnectionPool = request.app.state.redis_pool
     async with Redis(connection_pool=redis_pool) as redis:
-        url = await redis.get(f"task:url:{task_id}")
-    if not url:
-        return {"status": "not_ready"}
-    return {"url": url.decode()}
+        known = await redis.exists(task_status_key(task_id))
+    if not known:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Unknown task"
+        )
+
+    async def events() -> AsyncGenerator[bytes, None]:
+        async for event in stream_progress(redis_pool, task_id):
+            if event is None:
+                # SSE comment, keeps proxies from closing an idle stream
+                yield b": ping\n\n"
+            else:
+                yield b"data: " + event + b"\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _is_heavy(body: DownloadRequest, redis: Redis) -> bool:
+    """
+    Tell from a cached link extraction whether a download is heavy.
+
+    Nothing is extracted here. Without a cached extraction, or if it can't
+    be read, the download is queued as light, and the worker moves it to a
+    heavy queue once its own extraction shows it is long or large.
+    """
+    try:
+        data = await get_cached_link(redis, video_key(body.url))
+        return data is not None and is_heavy_download(data, body.res)
+    except (RedisError, ValueError) as exc:
+        logger.warning(
+            f"Failed to check the size of {body.url}, queued as light: {exc}"
+        )
+        return False
 
 
 @router.post("/download")
-async def download_video(body: DownloadRequest, authenticated: bool = Depends(api_key_or_rate_limit)) -> dict:
+async def download_video(
+    body: DownloadRequest,
+    request: Request,
+    authenticated: bool = Depends(api_key_or_rate_limit),
+) -> dict:
     """Download video in up to 4K with audio merged."""
-
-    task = await download_video_task.kiq(body.url, body.res, notify=authenticated)
+    # The record exists before a worker can pick the task up and move it on
+    task_id = uuid4().hex
+    async with Redis(connection_pool=request.app.state.redis_pool) as redis:
+        heavy = await _is_heavy(body, redis)
+        queue = download_queue(authenticated, heavy)
+        await set_task_status(redis, task_id, "queued", queue=queue)
+    metrics.inc("downloads_queued_total", queue="heavy" if heavy else "light")
+    # Bot and website downloads wait in separate queues, so a burst from
+    # one doesn't hold up the other. Long videos go to their own workers
+    task = await (
+        download_video_task.kicker()
+        .with_task_id(task_id)
+        .with_labels(queue_name=queue)
+        .kiq(body.url, body.res, notify=authenticated)
+    )
 
     return {"task_id": task.task_id}
@@ -1,4 +1,21 @@
-from fastapi import APIRouter
+import asyncio
+import shutil
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import PlainTextResponse
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import ResponseError
+
+from app.services.metrics.registry import (
+    SAMPLES_KEY,
+    TYPES_KEY,
+    render_gauge,
+    render_metrics,
+)
+from app.services.redis.video_index import index_totals
+from app.settings import settings
+from app.tasks.broker import broker
+from app.utils.common import verify_api_key
 
 router = APIRouter()
 
@@ -10,3 +27,70 @@ def health_check() -> None:
 
     It returns 200 if the project is healthy.
     """
+
+
+async def _queue_metrics(redis: Redis) -> str:
+    """Backlog and in-flight tasks per taskiq stream."""
+    lag: list[tuple[dict[str, str], float]] = []
+    in_flight: list[tuple[dict[str, str], float]] = []
+    for stream in [broker.queue_name, *broker.additional_streams]:
+        try:
+            groups = await redis.xinfo_groups(stream)
+        except ResponseError:
+            # The stream doesn't exist until the first task is sent
+            continue
+        for group in groups:
+            if group["name"].decode() != broker.consumer_group_name:
+                continue
+            labels = {"queue": stream}
+            # Tasks are acked after their result is saved, so pending
+            # entries are the ones workers are executing right now.
+            in_flight.append((labels, group["pending"]))
+            backlog = group.get("lag")
+            if backlog is None:
+                backlog = await redis.xlen(stream)
+            lag.append((labels, backlog))
+    return render_gauge("taskiq_queue_depth", lag) + render_gauge(
+        "taskiq_tasks_in_flight",
+        in_flight,
+    )
+
+
+async def _disk_metrics(redis: Redis) -> str:
+    """Stored videos, from the video index, and free space on their volume."""
+    files, size = await index_totals(redis)
+    free = 0
+    if settings.download_dir.exists():
+        usage = await asyncio.to_thread(shutil.disk_usage, settings.download_dir)
+        free = usage.free
+    return (
+        render_gauge("download_dir_files", [({}, files)])
+        + render_gauge("download_dir_bytes", [({}, size)])
+        + render_gauge("download_volume_free_bytes", [({}, free)])
+    )
+
+
+@router.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(verify_api_key)],
+)
+async def metrics_endpoint(request: Request) -> PlainTextResponse:
+    """
+    Metrics of all API and worker processes in Prometheus text format.
+
+    Counters and histograms are aggregated in Redis by every process,
+    queue and disk gauges are computed on each scrape. Scrapers send the
+    download API key in ``X-API-Key``.
+    """
+    redis_pool: ConnectionPool = request.app.state.redis_pool
+    async with Redis(connection_pool=redis_pool) as redis:
+        samples = await redis.hgetall(SAMPLES_KEY)
+        types = await redis.hgetall(TYPES_KEY)
+        queues = await _queue_metrics(redis)
+        disk = await _disk_metrics(redis)
+
+    return PlainTextResponse(
+        render_metrics(samples, types) + queues + disk,
+        media_type="text/plain; version=0.0.4",
+    )
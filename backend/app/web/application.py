@@ -5,6 +5,7 @@ from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
 from app.log import configure_logging
+from app.services.metrics.middleware import MetricsMiddleware
 from app.settings import settings
 from app.web.api.router import api_router
 from app.web.api.download import files_router
@@ -41,6 +42,8 @@ def get_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    app.add_middleware(MetricsMiddleware)
+
     # Main router for the API.
     app.include_router(router=api_router, prefix="/api")
 
@@ -2,10 +2,15 @@ from collections.abc import AsyncGenerator
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from redis.asyncio import Redis
 
 # TODO: restore when DB is needed
 # from app.db.base import database
+from app.services.metrics.flusher import start_metrics_flusher, stop_metrics_flusher
 from app.services.redis.lifespan import init_redis, shutdown_redis
+from app.services.redis.rate_limit import RateLimiter
+from app.services.streaming.lifespan import init_streaming, shutdown_streaming
+from app.services.ytdlp.lifespan import init_extraction, shutdown_extraction
 from app.tasks.broker import broker
 
 
@@ -27,6 +32,11 @@ async def lifespan_setup(
     # TODO: restore when DB is needed
     # await database.connect()
     init_redis(app)
+    app.state.rate_limiter = RateLimiter(app.state.redis_pool)
+    init_extraction(app)
+    init_streaming(app)
+    metrics_redis = Redis(connection_pool=app.state.redis_pool)
+    metrics_flusher = start_metrics_flusher(metrics_redis)
     if not broker.is_worker_process:
         await broker.startup()
     app.middleware_stack = app.build_middleware_stack()
@@ -36,4 +46,9 @@ async def lifespan_setup(
         await broker.shutdown()
     # TODO: restore when DB is needed
     # await database.disconnect()
+    shutdown_extraction(app)
+    await shutdown_streaming(app)
+    await stop_metrics_flusher(metrics_flusher, metrics_redis)
+    await metrics_redis.aclose()
+    await app.state.rate_limiter.close()
     await shutdown_redis(app)
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.account_pool import (
+    NoAccountAvailableError,
+    accounts_to_probe,
+    acquire_account,
+    finish_probe,
+    release_account,
+    renew_account,
+)
+from app.services.ytdlp.accounts import is_account_error
+from app.settings import settings
+
+ACCOUNTS = ("a.txt", "b.txt")
+
+
+@pytest.mark.anyio
+async def test_spreads_load_over_accounts(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that in-flight work steers new leases to the idle account.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        first = await acquire_account(redis, ACCOUNTS, 60)
+        second = await acquire_account(redis, ACCOUNTS, 60)
+
+        assert {first.account, second.account} == set(ACCOUNTS)
+
+        await release_account(redis, first, latency=0.1)
+        third = await acquire_account(redis, ACCOUNTS, 60)
+
+        assert third.account == first.account
+
+
+@pytest.mark.anyio
+async def test_renewed_lease_stays_in_flight(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that only a lease that isn't renewed stops counting as in flight.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        lease = await acquire_account(redis, ("a.txt",), 0.3)
+        await asyncio.sleep(0.2)
+        assert await renew_account(redis, lease, 60)
+        await asyncio.sleep(0.2)
+        assert await redis.zcard("accounts:leases:a.txt") == 1
+
+        dead = await acquire_account(redis, ("b.txt",), 0.1)
+        await asyncio.sleep(0.2)
+        # Expired leases are dropped by the next acquire
+        await acquire_account(redis, ("b.txt",), 60)
+        assert not await renew_account(redis, dead, 60)
+
+
+@pytest.mark.anyio
+async def test_blocked_account_trips_and_recovers(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that repeated blocks take an account out until it passes a probe.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    error = Exception("ERROR: [youtube] x: Sign in to confirm you're not a bot")
+    assert is_account_error(error)
+
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        for _ in range(settings.account_failure_threshold):
+            lease = await acquire_account(redis, ("a.txt",), 60)
+            tripped = await release_account(redis, lease, error, account_error=True)
+        assert tripped
+
+        with pytest.raises(NoAccountAvailableError):
+            await acquire_account(redis, ("a.txt",), 60)
+
+        # Rest period over, but not probed yet
+        await redis.delete("accounts:circuit:a.txt")
+        assert await accounts_to_probe(redis) == ["a.txt"]
+        with pytest.raises(NoAccountAvailableError):
+            await acquire_account(redis, ("a.txt",), 60)
+
+        await finish_probe(redis, "a.txt", passed=True)
+        lease = await acquire_account(redis, ("a.txt",), 60)
+        assert lease.account == "a.txt"
+
+
+def test_video_errors_are_not_account_errors() -> None:
+    """Tests that problems with the video don't count against accounts."""
+    assert not is_account_error(Exception("ERROR: [youtube] x: Video unavailable"))
+    assert not is_account_error(Exception("Sign in to confirm your age"))
+    assert is_account_error(Exception("HTTP Error 429: Too Many Requests"))
@@ -0,0 +1,56 @@
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.download_dedup import (
+    acquire_download,
+    complete_download,
+    release_download,
+)
+from app.settings import settings
+
+
+@pytest.mark.anyio
+async def test_duplicates_are_handed_the_download(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that a duplicate doesn't wait but is returned on completion.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    key = "download:file:a"
+    request = {"url": "https://youtu.be/a", "res": "720", "notify": True, "queue": "q"}
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        assert (await acquire_download(redis, key, "first", request)).claimed
+        # A redelivered task gets its own claim back
+        assert (await acquire_download(redis, key, "first", request)).claimed
+        assert (await acquire_download(redis, key, "second", request)).waiting
+
+        settings.download_dir.mkdir(parents=True, exist_ok=True)
+        (settings.download_dir / "a.mp4").touch()
+        waiters = await complete_download(redis, key, "a.mp4")
+        assert waiters == {"second": request}
+
+        claim = await acquire_download(redis, key, "third", request)
+        assert claim.filename == "a.mp4"
+
+
+@pytest.mark.anyio
+async def test_failed_download_returns_its_waiters(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that releasing a failed claim hands back the waiting tasks.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    key = "download:file:b"
+    request = {"url": "https://youtu.be/b", "res": "720", "notify": False, "queue": "q"}
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await acquire_download(redis, key, "first", request)
+        await acquire_download(redis, key, "second", request)
+
+        # Not the claimant anymore, the waiters stay with the claim
+        assert await release_download(redis, key, "second") == {}
+        assert await release_download(redis, key, "first") == {"second": request}
+        assert (await acquire_download(redis, key, "second", request)).claimed
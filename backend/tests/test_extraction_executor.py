@@ -0,0 +1,32 @@
+import threading
+
+import pytest
+
+from app.services.ytdlp.executor import ExtractionExecutor, ExtractionQueueFullError
+
+
+@pytest.mark.anyio
+async def test_runs_in_pool() -> None:
+    """Tests that jobs run outside of the event loop thread."""
+    executor = ExtractionExecutor(workers=1, queue_size=0, timeout=5)
+
+    thread_name = await executor.run(lambda: threading.current_thread().name)
+
+    assert thread_name.startswith("ytdlp-extract")
+    executor.shutdown()
+
+
+@pytest.mark.anyio
+async def test_rejects_when_queue_is_full() -> None:
+    """Tests that jobs over the backlog limit are rejected right away."""
+    executor = ExtractionExecutor(workers=1, queue_size=0, timeout=0.1)
+    release = threading.Event()
+
+    with pytest.raises(TimeoutError):
+        await executor.run(release.wait)
+    # The timed out job is still running and holds the only slot.
+    with pytest.raises(ExtractionQueueFullError):
+        await executor.run(release.wait)
+
+    release.set()
+    executor.shutdown()
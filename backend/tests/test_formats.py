@@ -0,0 +1,81 @@
+from app.services.ytdlp.formats import (
+    estimate_download_bytes,
+    is_heavy_download,
+    is_heavy_selection,
+    is_mp4_compatible,
+)
+from app.settings import settings
+
+
+def test_mp4_codecs_are_remuxed() -> None:
+    """Tests that only codecs MP4 can carry skip the transcode."""
+    merged = {
+        "requested_formats": [
+            {"vcodec": "avc1.640028", "acodec": "none"},
+            {"vcodec": "none", "acodec": "mp4a.40.2"},
+        ],
+    }
+    vp9 = {
+        "requested_formats": [
+            {"vcodec": "vp09.00.40.08", "acodec": "none"},
+            {"vcodec": "none", "acodec": "opus"},
+        ],
+    }
+
+    assert is_mp4_compatible(merged)
+    assert is_mp4_compatible({"vcodec": "av01.0.08M.08", "acodec": "mp4a.40.2"})
+    assert not is_mp4_compatible(vp9)
+    assert not is_mp4_compatible({"vcodec": "vp8", "acodec": "vorbis"})
+
+
+def test_unknown_codecs_go_by_container() -> None:
+    """Tests that formats without codec info are judged by extension."""
+    assert is_mp4_compatible({"ext": "mp4"})
+    assert not is_mp4_compatible({"ext": "webm"})
+
+
+def test_download_size_follows_requested_resolution() -> None:
+    """Tests that the estimate uses the format yt-dlp would pick for res."""
+    link = {
+        "duration": 600,
+        "filesize": 20_000_000,
+        "main_resolution": 360,
+        "resolutions": [
+            {"height": 2160, "filesize": 3_000_000_000},
+            {"height": 1080, "filesize": 400_000_000},
+            {"height": 720, "filesize": None},
+        ],
+        "audio": {"filesize": 10_000_000},
+    }
+
+    assert estimate_download_bytes(link, "2160") == 3_010_000_000
+    assert estimate_download_bytes(link, "1440") == 410_000_000
+    assert estimate_download_bytes(link, "720") is None
+    assert estimate_download_bytes(link, "480") == 20_000_000
+    assert estimate_download_bytes(link, "240") == 20_000_000
+    assert is_heavy_download(link, "2160")
+    assert not is_heavy_download(link, "1080")
+
+
+def test_long_or_unknown_videos_are_heavy() -> None:
+    """Tests that duration alone, or no information at all, makes a download heavy."""
+    long_video = {"duration": settings.heavy_download_min_seconds, "resolutions": []}
+
+    assert is_heavy_download(long_video, "360")
+    assert is_heavy_download({"resolutions": []}, "360")
+    assert not is_heavy_download({"duration": 15, "resolutions": []}, "360")
+
+
+def test_selected_formats_are_classified() -> None:
+    """Tests that the worker classifies the formats yt-dlp picked."""
+    merged = {
+        "duration": 60,
+        "requested_formats": [
+            {"filesize": settings.heavy_download_min_bytes},
+            {"filesize_approx": 1_000_000},
+        ],
+    }
+
+    assert is_heavy_selection(merged)
+    assert not is_heavy_selection({"duration": 60, "filesize_approx": 1_000_000})
+    assert is_heavy_selection({})
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.lease import acquire_lease, hold_lease
+from app.settings import settings
+
+
+@pytest.mark.anyio
+async def test_held_lease_is_exclusive_and_renewed(
+    fake_redis_pool: ConnectionPool,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Tests that nobody takes a lease while its holder runs, however long.
+
+    :param fake_redis_pool: fake redis pool.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    monkeypatch.setattr(settings, "worker_lease_seconds", 0.3)
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        async with hold_lease(redis, "lease:test", "test"):
+            await asyncio.sleep(0.6)
+            assert await acquire_lease(redis, "lease:test") is None
+
+        assert await acquire_lease(redis, "lease:test") is not None
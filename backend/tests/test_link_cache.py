@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.link_cache import (
+    ExtractionFailedError,
+    cache_link,
+    get_cached_link,
+    get_or_extract_link,
+    link_cache_key,
+    link_cache_ttl,
+)
+from app.services.ytdlp.identity import video_key
+from app.settings import settings
+
+
+def _response(expire: int | None) -> dict:
+    query = f"?expire={expire}&ei=abc" if expire else ""
+    return {
+        "title": "video",
+        "url": f"https://rr1---sn.googlevideo.com/videoplayback{query}",
+        "resolutions": [],
+    }
+
+
+def test_video_key_ignores_url_shape() -> None:
+    """Tests that different links to the same video share a key."""
+    assert (
+        video_key("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10")
+        == video_key("https://youtu.be/dQw4w9WgXcQ")
+        == "Youtube:dQw4w9WgXcQ"
+    )
+
+
+def test_ttl_follows_url_expiry() -> None:
+    """Tests that the cache TTL ends before the signed URLs expire."""
+    expire = int(time.time()) + 1000
+
+    ttl = link_cache_ttl(_response(expire))
+
+    assert ttl <= 1000 - settings.link_cache_expiry_margin_seconds
+    assert ttl > 0
+    assert link_cache_ttl(_response(None)) == settings.link_cache_default_seconds
+
+    # The audio track of muxed formats may expire first
+    with_audio = _response(expire)
+    with_audio["audio"] = {
+        "url": f"https://rr1---sn.googlevideo.com/a?expire={expire - 500}"
+    }
+    assert link_cache_ttl(with_audio) <= 500 - settings.link_cache_expiry_margin_seconds
+
+
+@pytest.mark.anyio
+async def test_expired_links_are_not_cached(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that responses with already expiring URLs are not stored.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    expiring = _response(int(time.time()) + 10)
+    fresh = _response(int(time.time()) + 3600)
+
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await cache_link(redis, "Youtube:a", expiring)
+        await cache_link(redis, "Youtube:b", fresh)
+
+        assert await get_cached_link(redis, "Youtube:a") is None
+        assert await get_cached_link(redis, "Youtube:b") == fresh
+        assert await redis.ttl(link_cache_key("Youtube:b")) > 0
+
+
+@pytest.mark.anyio
+async def test_concurrent_extractions_are_coalesced(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that concurrent requests for one video extract it only once.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    calls = 0
+    response = _response(int(time.time()) + 3600)
+
+    async def extract() -> dict:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.2)
+        return response
+
+    results = await asyncio.gather(
+        *[get_or_extract_link(fake_redis_pool, "Youtube:c", extract) for _ in range(5)]
+    )
+
+    assert calls == 1
+    assert results == [response] * 5
+
+
+@pytest.mark.anyio
+async def test_failures_are_shared_briefly(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that requests right after a failed extraction get its error.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    calls = 0
+
+    async def extract() -> dict:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.2)
+        raise ValueError("Video unavailable")
+
+    results = await asyncio.gather(
+        *[get_or_extract_link(fake_redis_pool, "Youtube:d", extract) for _ in range(3)],
+        return_exceptions=True,
+    )
+
+    assert calls == 1
+    assert isinstance(results[0], ValueError)
+    assert all(isinstance(result, ExtractionFailedError) for result in results[1:])
+    assert results[1].error == "ValueError"
+    with pytest.raises(ExtractionFailedError):
+        await get_or_extract_link(fake_redis_pool, "Youtube:d", extract)
+    assert calls == 1
+
+
+@pytest.mark.anyio
+async def test_cache_hits_dont_subscribe(
+    fake_redis_pool: ConnectionPool,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Tests that a cached response is returned without a pub/sub connection.
+
+    :param fake_redis_pool: fake redis pool.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    response = _response(int(time.time()) + 3600)
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await cache_link(redis, "Youtube:e", response)
+
+    def no_pubsub(_redis: Redis, **_options: object) -> None:
+        raise AssertionError("subscribed on a cache hit")
+
+    monkeypatch.setattr(Redis, "pubsub", no_pubsub)
+
+    async def extract() -> dict:
+        raise AssertionError("extracted on a cache hit")
+
+    assert await get_or_extract_link(fake_redis_pool, "Youtube:e", extract) == response
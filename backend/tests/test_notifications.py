@@ -0,0 +1,53 @@
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.notifications import (
+    NOTIFY_DUE_KEY,
+    claim_notifications,
+    finish_notifications,
+    queue_notification,
+    retry_notifications,
+)
+
+
+@pytest.mark.anyio
+async def test_task_is_notified_once(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that a retried task doesn't queue a second notification.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        assert await queue_notification(redis, "task", "https://videos/a.mp4")
+        assert not await queue_notification(redis, "task", "https://videos/b.mp4")
+
+        claimed = await claim_notifications(redis, 10)
+        assert claimed == [("task", "https://videos/a.mp4", 0)]
+        # Claimed, so other senders don't get it
+        assert await claim_notifications(redis, 10) == []
+
+        await finish_notifications(redis, ["task"])
+        assert not await queue_notification(redis, "task", "https://videos/a.mp4")
+        assert await redis.zcard(NOTIFY_DUE_KEY) == 0
+
+
+@pytest.mark.anyio
+async def test_failed_notification_is_retried_later(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that a failed notification comes back after a delay, counted.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await queue_notification(redis, "task", "https://videos/a.mp4")
+        await claim_notifications(redis, 10)
+
+        await retry_notifications(redis, [("task", 0)])
+        assert await claim_notifications(redis, 10) == []
+
+        # Make it due now
+        await redis.zadd(NOTIFY_DUE_KEY, {"task": 0})
+        claimed = await claim_notifications(redis, 10)
+        assert claimed == [("task", "https://videos/a.mp4", 1)]
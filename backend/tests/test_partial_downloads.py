@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis import lease
+from app.services.redis.lease import acquire_lease
+from app.settings import settings
+from app.tasks import cleanup_tasks, download_tasks
+from app.tasks.download_tasks import DownloadResult
+
+
+@pytest.fixture
+def download_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """
+    Point downloads and their working directories to a temporary directory.
+
+    :param tmp_path: temporary directory.
+    :param monkeypatch: pytest monkeypatch.
+    :return: the download directory.
+    """
+    monkeypatch.setattr(settings, "download_dir", tmp_path)
+    monkeypatch.setattr(download_tasks, "PARTIAL_DIR", tmp_path / ".partial")
+    monkeypatch.setattr(cleanup_tasks, "PARTIAL_DIR", tmp_path / ".partial")
+    return tmp_path
+
+
+def _context(task_id: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        state=SimpleNamespace(download_admission=asyncio.Semaphore(2)),
+        message=SimpleNamespace(
+            task_id=task_id,
+            labels={"queue_name": "downloads:bot:light"},
+        ),
+    )
+
+
+@pytest.mark.anyio
+async def test_task_copies_take_turns(
+    fake_redis_pool: ConnectionPool,
+    download_dir: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Tests that a second copy of a task waits, then finds the video done.
+
+    :param fake_redis_pool: fake redis pool.
+    :param download_dir: download directory.
+    :param monkeypatch: pytest monkeypatch.
+    """
+    monkeypatch.setattr(lease, "_WAIT_POLL_SECONDS", 0.05)
+    running = 0
+    downloads = 0
+
+    async def download(*_args: object, **_kwargs: object) -> DownloadResult:
+        nonlocal running, downloads
+        running += 1
+        downloads += 1
+        assert running == 1
+        await asyncio.sleep(0.2)
+        (download_dir / "video.mp4").write_bytes(b"video")
+        running -= 1
+        return DownloadResult("video.mp4", 5, {})
+
+    monkeypatch.setattr(download_tasks, "_download_as_account", download)
+
+    results = await asyncio.gather(
+        *(
+            download_tasks.download_video(
+                "https://youtu.be/dQw4w9WgXcQ",
+                "720",
+                context=_context("task"),
+                redis_pool=fake_redis_pool,
+            )
+            for _ in range(2)
+        )
+    )
+
+    assert results == ["video.mp4", "video.mp4"]
+    assert downloads == 1
+
+
+@pytest.mark.anyio
+async def test_cleanup_keeps_leased_directories(
+    fake_redis_pool: ConnectionPool,
+    download_dir: Path,
+) -> None:
+    """
+    Tests that idle partial downloads are removed unless a task holds them.
+
+    :param fake_redis_pool: fake redis pool.
+    :param download_dir: download directory.
+    """
+    idle = time.time() - settings.partial_download_keep_seconds - 60
+    for task_id in ("abandoned", "waiting"):
+        directory = download_dir / ".partial" / task_id
+        directory.mkdir(parents=True)
+        (directory / "video.part").write_bytes(b"part")
+        os.utime(directory / "video.part", (idle, idle))
+        os.utime(directory, (idle, idle))
+
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await acquire_lease(redis, download_tasks.work_dir_lease_key("waiting"))
+
+    assert await cleanup_tasks.cleanup_partial_downloads(fake_redis_pool) == 1
+    assert not (download_dir / ".partial" / "abandoned").exists()
+    assert (download_dir / ".partial" / "waiting" / "video.part").exists()
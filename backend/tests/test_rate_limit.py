@@ -0,0 +1,64 @@
+import uuid
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.rate_limit import RateLimiter
+
+
+@pytest.mark.anyio
+async def test_denies_over_limit(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that requests over the limit are denied.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    limiter = RateLimiter(fake_redis_pool)
+    key = f"ratelimit:test:{uuid.uuid4().hex}"
+
+    results = [await limiter.check(key, limit=2, window_seconds=60) for _ in range(3)]
+
+    assert [result.allowed for result in results] == [True, True, False]
+    assert results[-1].retry_after > 0
+    await limiter.close()
+
+
+@pytest.mark.anyio
+async def test_reloads_flushed_script(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that the limiter recovers after Redis forgets the script.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    limiter = RateLimiter(fake_redis_pool)
+    key = f"ratelimit:test:{uuid.uuid4().hex}"
+
+    await limiter.check(key, limit=5, window_seconds=60)
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await redis.script_flush()
+    result = await limiter.check(key, limit=5, window_seconds=60)
+
+    assert result.allowed
+    assert result.current_count == 2
+    await limiter.close()
+
+
+@pytest.mark.anyio
+async def test_denied_keys_skip_redis(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that repeat offenders are rejected from the local cache.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    limiter = RateLimiter(fake_redis_pool)
+    key = f"ratelimit:test:{uuid.uuid4().hex}"
+    await limiter.check(key, limit=1, window_seconds=60)
+    denied = await limiter.check(key, limit=1, window_seconds=60)
+
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await redis.flushall()
+    result = await limiter.check(key, limit=1, window_seconds=60)
+
+    assert not result.allowed
+    assert 0 < result.retry_after <= denied.retry_after
+    await limiter.close()
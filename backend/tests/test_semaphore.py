@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.semaphore import (
+    ConcurrencyLimitError,
+    acquire_slots,
+    hold_slots,
+    release_slots,
+)
+
+
+@pytest.mark.anyio
+async def test_slots_are_taken_all_or_nothing(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that a full semaphore blocks without using slots of the others.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        proxy_lease = await acquire_slots(redis, {"semaphore:test:proxy": 1}, 60)
+        assert proxy_lease is not None
+
+        limits = {"semaphore:test:proxy": 1, "semaphore:test:site": 1}
+        assert await acquire_slots(redis, limits, 60) is None
+        assert await redis.zcard("semaphore:test:site") == 0
+
+        await release_slots(redis, ["semaphore:test:proxy"], proxy_lease)
+        assert await acquire_slots(redis, limits, 60) is not None
+
+
+@pytest.mark.anyio
+async def test_expired_leases_free_their_slot(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that a holder that died without releasing stops counting.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await acquire_slots(redis, {"semaphore:test:site": 1}, -1)
+
+        async with hold_slots(redis, {"semaphore:test:site": 1}, 60, timeout=0):
+            with pytest.raises(ConcurrencyLimitError):
+                async with hold_slots(redis, {"semaphore:test:site": 1}, 60, timeout=0):
+                    pass
+
+        assert await redis.zcard("semaphore:test:site") == 0
+
+
+@pytest.mark.anyio
+async def test_held_slots_are_renewed(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that a short lease outlives its length while the block runs.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        async with hold_slots(redis, {"semaphore:test:site": 1}, 0.3):
+            await asyncio.sleep(0.6)
+            assert await acquire_slots(redis, {"semaphore:test:site": 1}, 60) is None
@@ -0,0 +1,28 @@
+import time
+
+from app.services.streaming.links import StreamLinks
+
+
+def _link(expires_in: int) -> dict:
+    expire = int(time.time()) + expires_in
+    return {"url": f"https://rr1---sn.googlevideo.com/videoplayback?expire={expire}"}
+
+
+def test_links_are_kept_per_resolution() -> None:
+    """Tests that seeks of a stream get its link until it expires."""
+    links = StreamLinks(size=2)
+    link = _link(3600)
+
+    links.put("Youtube:a", 720, link)
+    links.put("Youtube:b", None, _link(3600))
+    # About to expire, not worth keeping
+    links.put("Youtube:c", None, _link(10))
+
+    assert links.get("Youtube:a", 720) is link
+    assert links.get("Youtube:a", 1080) is None
+    assert links.get("Youtube:c", None) is None
+
+    # The least recently used one makes room
+    links.put("Youtube:d", None, _link(3600))
+    assert links.get("Youtube:b", None) is None
+    assert links.get("Youtube:a", 720) is link
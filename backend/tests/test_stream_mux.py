@@ -0,0 +1,132 @@
+import functools
+import shutil
+import subprocess
+import threading
+from collections.abc import Iterator
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+import pytest
+
+from app.services.streaming.mux import MuxError, TrackMuxer
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None,
+    reason="ffmpeg is not installed",
+)
+
+
+def _ffmpeg(*args: str) -> str:
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-y", *args],
+        capture_output=True,
+        text=True,
+    )
+    return result.stderr
+
+
+class _MediaHandler(SimpleHTTPRequestHandler):
+    """Serves files, and those under /cut/ only halfway, then hangs up."""
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if not self.path.startswith("/cut/"):
+            super().do_GET()
+            return
+        data = (Path(self.directory) / self.path.removeprefix("/cut/")).read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data[: len(data) // 2])
+        self.close_connection = True
+
+
+@pytest.fixture
+def media_server(tmp_path: Path) -> Iterator[str]:
+    """
+    Serve a video-only and an audio-only track over HTTP, like a CDN.
+
+    The tracks are fragmented like DASH formats, so ffmpeg can read them
+    from a pipe.
+
+    :yield: base URL of the server.
+    """
+    _ffmpeg(
+        "-f", "lavfi", "-i", "testsrc=duration=2:size=160x120:rate=10",
+        "-an", "-c:v", "mpeg4", "-movflags", "frag_keyframe+empty_moov",
+        str(tmp_path / "video.mp4"),
+    )  # fmt: skip
+    _ffmpeg(
+        "-f", "lavfi", "-i", "sine=duration=2",
+        "-vn", "-c:a", "aac", "-movflags", "frag_keyframe+empty_moov",
+        str(tmp_path / "audio.m4a"),
+    )  # fmt: skip
+
+    handler = functools.partial(_MediaHandler, directory=str(tmp_path))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_port}"
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.anyio
+async def test_tracks_are_muxed_into_one_stream(
+    media_server: str,
+    tmp_path: Path,
+) -> None:
+    """Tests that separate video and audio come out as one fragmented MP4."""
+    async with httpx.AsyncClient() as client:
+        muxer = TrackMuxer(
+            client,
+            video={"url": f"{media_server}/video.mp4"},
+            audio={"url": f"{media_server}/audio.m4a"},
+            chunk_size=4096,
+        )
+        await muxer.start()
+        chunks = [chunk async for chunk in muxer.chunks()]
+
+    output = b"".join(chunks)
+    assert len(chunks) > 1
+    assert b"moof" in output
+
+    (tmp_path / "muxed.mp4").write_bytes(output)
+    info = _ffmpeg("-i", str(tmp_path / "muxed.mp4"))
+    assert "Video: mpeg4" in info
+    assert "Audio: aac" in info
+
+
+@pytest.mark.anyio
+async def test_missing_track_fails_before_streaming(media_server: str) -> None:
+    """Tests that a track the server can't return is reported up front."""
+    async with httpx.AsyncClient() as client:
+        muxer = TrackMuxer(
+            client,
+            video={"url": f"{media_server}/video.mp4"},
+            audio={"url": f"{media_server}/missing.m4a"},
+            chunk_size=4096,
+        )
+        with pytest.raises(httpx.HTTPStatusError):
+            await muxer.start()
+
+
+@pytest.mark.anyio
+async def test_cut_track_fails_the_stream(media_server: str) -> None:
+    """Tests that a track cut short mid-stream doesn't end as a complete MP4."""
+    async with httpx.AsyncClient() as client:
+        muxer = TrackMuxer(
+            client,
+            video={"url": f"{media_server}/video.mp4"},
+            audio={"url": f"{media_server}/cut/audio.m4a"},
+            chunk_size=4096,
+        )
+        await muxer.start()
+        with pytest.raises(MuxError):
+            async for _ in muxer.chunks():
+                pass
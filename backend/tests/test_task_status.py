@@ -0,0 +1,72 @@
+import fakeredis
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.services.redis.task_progress import (
+    ProgressPublisher,
+    progress_key,
+    publish_progress,
+    stream_progress,
+)
+from app.services.redis.task_status import get_task_status, set_task_status
+
+
+@pytest.mark.anyio
+async def test_status_follows_progress_until_final(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that progress stages move the status and a failed task stays failed.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        assert await get_task_status(redis, "task") is None
+
+        await set_task_status(redis, "task", "queued", queue="downloads:web:light")
+        await publish_progress(redis, "task", {"stage": "remux"})
+        await publish_progress(
+            redis, "task", {"stage": "failed", "error": "DownloadError"}
+        )
+        assert not await set_task_status(redis, "task", "downloading")
+
+        record = await get_task_status(redis, "task")
+        assert record["status"] == "failed"
+        assert record["error"] == "DownloadError"
+        assert record["queue"] == "downloads:web:light"
+        assert record["queued_at"] <= record["merging_at"] <= record["failed_at"]
+        assert "downloading_at" not in record
+
+
+@pytest.mark.anyio
+async def test_expired_progress_ends_with_the_final_status(
+    fake_redis_pool: ConnectionPool,
+) -> None:
+    """
+    Tests that a finished task's stream ends even after its snapshot expired.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await set_task_status(redis, "task", "queued")
+        await publish_progress(
+            redis, "task", {"stage": "done", "url": "https://videos/a.mp4"}
+        )
+        await redis.delete(progress_key("task"))
+
+    events = [event async for event in stream_progress(fake_redis_pool, "task")]
+
+    assert events == [b'{"stage":"done","url":"https://videos/a.mp4"}']
+
+
+def test_progress_survives_redis_errors() -> None:
+    """Tests that a failing Redis doesn't break the download reporting to it."""
+    server = fakeredis.FakeServer()
+    server.connected = False
+    publisher = ProgressPublisher("task")
+    publisher._redis = fakeredis.FakeRedis(server=server)
+
+    publisher.hook({"status": "downloading", "downloaded_bytes": 1})
+    publisher.postprocessor_hook({"status": "started", "postprocessor": "Merger"})
+
+    assert publisher._stage == "merge"
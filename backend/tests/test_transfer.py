@@ -0,0 +1,141 @@
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import yt_dlp
+
+from app.services.ytdlp.transfer import transfer_options
+from app.settings import settings
+
+VIDEO = bytes(range(256)) * 400
+SEGMENTS = 6
+CHUNK_BYTES = 16 * 1024
+
+
+class _CdnHandler(BaseHTTPRequestHandler):
+    """
+    A progressive MP4 that honours Range, and an HLS playlist.
+
+    Records the ranges asked for and the most segments fetched at once.
+    """
+
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    ranges: list[str | None] = []
+    in_flight = 0
+    most_in_flight = 0
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def _send(self, code: int, content_type: str, body: bytes, **headers: str) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name.replace("_", "-"), value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/video.mp4":
+            self._send_video()
+        elif self.path == "/playlist.m3u8":
+            playlist = "#EXTM3U\n#EXT-X-TARGETDURATION:1\n"
+            playlist += "".join(f"#EXTINF:1.0,\nseg{i}.ts\n" for i in range(SEGMENTS))
+            playlist += "#EXT-X-ENDLIST\n"
+            self._send(200, "application/vnd.apple.mpegurl", playlist.encode())
+        elif self.path.startswith("/seg"):
+            self._send_segment()
+        else:
+            self.send_error(404)
+
+    def _send_video(self) -> None:
+        requested = self.headers.get("Range")
+        self.ranges.append(requested)
+        if requested is None:
+            self._send(200, "video/mp4", VIDEO, Accept_Ranges="bytes")
+            return
+        first, last = requested.removeprefix("bytes=").split("-")
+        start = int(first)
+        end = min(int(last), len(VIDEO) - 1) if last else len(VIDEO) - 1
+        self._send(
+            206,
+            "video/mp4",
+            VIDEO[start : end + 1],
+            Accept_Ranges="bytes",
+            Content_Range=f"bytes {start}-{end}/{len(VIDEO)}",
+        )
+
+    def _send_segment(self) -> None:
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.most_in_flight = max(cls.most_in_flight, cls.in_flight)
+        # Slow enough for parallel requests to overlap
+        time.sleep(0.2)
+        with cls.lock:
+            cls.in_flight -= 1
+        self._send(200, "video/mp2t", b"\x47" + bytes(187))
+
+
+@pytest.fixture
+def cdn(monkeypatch: pytest.MonkeyPatch) -> Iterator[str]:
+    """
+    Serve media over HTTP, like a CDN.
+
+    :param monkeypatch: pytest monkeypatch.
+    :yield: base URL of the server.
+    """
+    monkeypatch.setattr(_CdnHandler, "ranges", [])
+    monkeypatch.setattr(_CdnHandler, "most_in_flight", 0)
+    monkeypatch.setattr(settings, "download_fragment_concurrency", 4)
+    monkeypatch.setattr(settings, "download_chunk_bytes", CHUNK_BYTES)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _CdnHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{server.server_port}"
+
+    server.shutdown()
+    server.server_close()
+
+
+def _download(url: str, tmp_path: Path, backoff_level: int = 0) -> None:
+    options = {
+        "quiet": True,
+        "noprogress": True,
+        "fixup": "never",
+        "outtmpl": str(tmp_path / "%(id)s.%(ext)s"),
+        **transfer_options("127.0.0.1", backoff_level),
+    }
+    with yt_dlp.YoutubeDL(options) as ydl:
+        ydl.download([url])
+
+
+def test_single_files_come_in_ranged_chunks(cdn: str, tmp_path: Path) -> None:
+    """Tests that a progressive file is fetched in Range requests of the chunk size."""
+    _download(f"{cdn}/video.mp4", tmp_path)
+
+    # The first request only probes the file
+    ranges = [value for value in _CdnHandler.ranges if value is not None]
+    sizes = []
+    for value in ranges:
+        first, last = value.removeprefix("bytes=").split("-")
+        sizes.append(int(last) - int(first) + 1)
+    assert len(ranges) >= len(VIDEO) // CHUNK_BYTES
+    assert max(sizes) <= CHUNK_BYTES
+    assert (tmp_path / "video.mp4").read_bytes() == VIDEO
+
+
+def test_fragments_come_in_parallel(cdn: str, tmp_path: Path) -> None:
+    """Tests that HLS segments are fetched in parallel, fewer after backoff."""
+    _download(f"{cdn}/playlist.m3u8", tmp_path)
+    assert _CdnHandler.most_in_flight == 4
+
+    _CdnHandler.most_in_flight = 0
+    _download(f"{cdn}/playlist.m3u8", tmp_path / "backoff", backoff_level=2)
+    assert _CdnHandler.most_in_flight == 1
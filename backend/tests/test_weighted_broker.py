@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from redis.asyncio import ConnectionPool, Redis
+
+from app.tasks.broker import WeightedStreamBroker
+
+
+@pytest.mark.anyio
+async def test_streams_are_read_by_weight(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that every round takes up to ``weight`` tasks from each stream.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    broker = WeightedStreamBroker(
+        "redis://localhost",
+        queue_weights={"test:light": 1, "test:heavy": 3},
+        consumer_id="0",
+    )
+    broker.connection_pool = fake_redis_pool
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        for stream in ("test:light", "test:heavy"):
+            await redis.xgroup_create(
+                stream, broker.consumer_group_name, id="0", mkstream=True
+            )
+            for number in range(4):
+                await redis.xadd(stream, {b"data": f"{stream}:{number}".encode()})
+
+    messages = broker.listen()
+    received = [(await anext(messages)).data for _ in range(8)]
+    await messages.aclose()
+
+    assert received == [
+        b"test:heavy:0",
+        b"test:heavy:1",
+        b"test:heavy:2",
+        b"test:light:0",
+        b"test:heavy:3",
+        b"test:light:1",
+        b"test:light:2",
+        b"test:light:3",
+    ]
+
+
+@pytest.mark.anyio
+async def test_held_tasks_dont_go_idle(fake_redis_pool: ConnectionPool) -> None:
+    """
+    Tests that tasks taken by a live worker keep resetting their idle time.
+
+    :param fake_redis_pool: fake redis pool.
+    """
+    broker = WeightedStreamBroker(
+        "redis://localhost",
+        queue_weights={"test:heavy": 1},
+        consumer_id="0",
+        idle_timeout=400,
+    )
+    broker.connection_pool = fake_redis_pool
+    async with Redis(connection_pool=fake_redis_pool) as redis:
+        await redis.xgroup_create(
+            "test:heavy", broker.consumer_group_name, id="0", mkstream=True
+        )
+        await redis.xadd("test:heavy", {b"data": b"long"})
+
+        messages = broker.listen()
+        message = await anext(messages)
+        await asyncio.sleep(0.6)
+        pending = await redis.xpending_range(
+            "test:heavy",
+            broker.consumer_group_name,
+            min="-",
+            max="+",
+            count=10,
+        )
+        assert pending[0]["time_since_delivered"] < 400
+
+        await message.ack()
+        await messages.aclose()
+        await broker.shutdown()